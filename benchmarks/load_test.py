@@ -0,0 +1,324 @@
+"""Load test the print server and the relay in front of it
+
+Starts desktop/flask-api-server.py and user side/main.py as separate
+processes in a temp directory (the print server on a copy of desktop/data),
+registers --shops benchmark shops, then replays a weighted mix of requests
+at each --concurrency level for --duration seconds:
+
+    register_shop   re-register a benchmark shop with its QR code
+    submit_job      POST /api/submit-print-job with a sample document
+    relay_submit    submit a sample document through the relay
+    list_shops      GET /api/shops
+    admin           GET /admin
+
+Sample documents are desktop/data/print_jobs/*/*. Reports p50/p95/p99
+latency, requests per second and errors per operation and level, and writes
+them with the commit and settings to --json, so runs can be compared across
+commits and storage backends.
+
+    python benchmarks/load_test.py --storage json sqlite --concurrency 1 8 32 \\
+        --mix submit_job=4 relay_submit=2 list_shops=3 admin=1 register_shop=1
+"""
+import argparse
+import glob
+import importlib.util
+import io
+import itertools
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DESKTOP = os.path.join(ROOT, 'desktop')
+USER_SIDE = os.path.join(ROOT, 'user side')
+
+import requests
+
+DEFAULT_MIX = ['submit_job=4', 'relay_submit=2', 'list_shops=3', 'admin=1', 'register_shop=1']
+# Server entry points and the directories copied into their working directory
+SERVERS = {
+    'print': (DESKTOP, 'flask-api-server.py', ('data', 'templates')),
+    'relay': (USER_SIDE, 'main.py', ('templates',)),
+}
+
+
+def serve(role, workdir):
+    """Run one server on a free port (in a child process), printing its URL"""
+    source, script, folders = SERVERS[role]
+    for folder in folders:
+        shutil.copytree(os.path.join(source, folder), os.path.join(workdir, folder))
+    os.chdir(workdir)
+    sys.path.insert(0, source)
+
+    spec = importlib.util.spec_from_file_location(f'{role}_server', os.path.join(source, script))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, module.app, threaded=True)
+    print(f"http://127.0.0.1:{server.server_port}", flush=True)
+    server.serve_forever()
+
+
+def start_server(role, workdir, env):
+    """Start serve(role) in a child process, returns (process, URL)
+
+    The server's log goes to <workdir>.log.
+    """
+    os.makedirs(workdir)
+    log_path = f"{workdir}.log"
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', role, workdir],
+                                   stdout=subprocess.PIPE, stderr=log, text=True, env=env)
+    url = process.stdout.readline().strip()
+    if not url:
+        process.wait()
+        with open(log_path, 'r') as log:
+            raise RuntimeError(f"The {role} server didn't start:\n{log.read()}")
+    return process, url
+
+
+def qr_png(shop_id, server_url):
+    sys.path.insert(0, DESKTOP)
+    from qr_payload import build_payload, make_qr, png_image
+    buffered = io.BytesIO()
+    png_image(make_qr(build_payload(shop_id, server_url))).save(buffered)
+    return buffered.getvalue()
+
+
+class Target:
+    """The servers under test and what the operations send them"""
+
+    def __init__(self, print_url, relay_url, shop_ids, documents):
+        self.print_url = print_url
+        self.relay_url = relay_url
+        self.shop_ids = shop_ids
+        self.documents = documents
+        self.qr_image = qr_png(shop_ids[0], print_url)
+
+
+def register_shop(session, target, rng, shop_id=None):
+    shop_id = shop_id or rng.choice(target.shop_ids)
+    return session.post(f"{target.print_url}/api/register_shop",
+                        data={'shop_id': shop_id, 'shop_name': shop_id, 'server_url': target.print_url},
+                        files={'qr_code_image': (f'{shop_id}.png', target.qr_image, 'image/png')})
+
+
+def submit_job(session, target, rng):
+    filename, data = rng.choice(target.documents)
+    return session.post(f"{target.print_url}/api/submit-print-job",
+                        data={'shop_id': rng.choice(target.shop_ids), 'copies': '1',
+                              'color': 'false', 'paper_size': 'A4'},
+                        files={'file': (filename, data)})
+
+
+def relay_submit(session, target, rng):
+    filename, data = rng.choice(target.documents)
+    return session.post(f"{target.relay_url}/",
+                        data={'shopId': rng.choice(target.shop_ids), 'serverUrl': target.print_url,
+                              'copies': '1', 'printType': 'bw', 'paperSize': 'A4'},
+                        files={'file': (filename, data)})
+
+
+def list_shops(session, target, rng):
+    return session.get(f"{target.print_url}/api/shops")
+
+
+def admin(session, target, rng):
+    return session.get(f"{target.print_url}/admin")
+
+
+OPERATIONS = {
+    'register_shop': register_shop,
+    'submit_job': submit_job,
+    'relay_submit': relay_submit,
+    'list_shops': list_shops,
+    'admin': admin,
+}
+
+
+def parse_mix(items):
+    """['submit_job=4', ...] -> {'submit_job': 4.0, ...}"""
+    mix = {}
+    for item in items:
+        name, _, weight = item.partition('=')
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r}, expected one of {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(latency for latency, _ in samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, ok in samples if not ok),
+        'rps': round(len(samples) / elapsed, 1) if elapsed else 0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1) if latencies else None
+    }
+
+
+def run_level(target, mix, concurrency, duration, seed):
+    """Replay the mix from concurrency workers for duration seconds"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    errors = {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        # Each worker's sequence of operations depends only on the seed
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = OPERATIONS[name](session, target, rng)
+                ok = response.status_code < 400
+                error = None if ok else f"HTTP {response.status_code}"
+            except requests.RequestException as e:
+                ok = False
+                error = type(e).__name__
+            latency = time.perf_counter() - start
+            with lock:
+                samples[name].append((latency, ok))
+                if error:
+                    errors[f"{name}: {error}"] = errors.get(f"{name}: {error}", 0) + 1
+        session.close()
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 2),
+        'total': summarize(list(itertools.chain(*samples.values())), elapsed),
+        'operations': {name: summarize(samples[name], elapsed) for name in names},
+        'errors': errors
+    }
+
+
+def run_backend(storage, args, mix, documents, workdir):
+    """Start fresh servers on the storage backend and run every concurrency level"""
+    env = dict(os.environ, XEROX_STORAGE=storage)
+    processes = []
+    try:
+        process, print_url = start_server('print', os.path.join(workdir, storage, 'print'), env)
+        processes.append(process)
+        process, relay_url = start_server('relay', os.path.join(workdir, storage, 'relay'), env)
+        processes.append(process)
+
+        shop_ids = [f"bench_{index}" for index in range(args.shops)]
+        target = Target(print_url, relay_url, shop_ids, documents)
+        with requests.Session() as session:
+            for shop_id in shop_ids:
+                register_shop(session, target, None, shop_id).raise_for_status()
+
+        levels = []
+        for concurrency in args.concurrency:
+            if args.warmup:
+                run_level(target, mix, concurrency, args.warmup, args.seed)
+            level = run_level(target, mix, concurrency, args.duration, args.seed)
+            level['storage'] = storage
+            levels.append(level)
+            total = level['total']
+            print(f"{storage:7} c={concurrency:<4} {total['rps']:>8} req/s  p50 {total['p50_ms']} ms  "
+                  f"p95 {total['p95_ms']} ms  p99 {total['p99_ms']} ms  {total['errors']} errors")
+        return levels
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the print server and relay")
+    parser.add_argument('--storage', nargs='+', choices=('json', 'sqlite'), default=['json'],
+                        help="print server storage backends to test")
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 8, 32],
+                        help="concurrent clients per level")
+    parser.add_argument('--duration', type=float, default=20, help="seconds per level")
+    parser.add_argument('--warmup', type=float, default=2, help="unmeasured seconds before each level")
+    parser.add_argument('--mix', nargs='+', default=DEFAULT_MIX,
+                        help=f"operation=weight pairs, operations: {', '.join(OPERATIONS)}")
+    parser.add_argument('--shops', type=int, default=20, help="benchmark shops to register")
+    parser.add_argument('--files', nargs='*',
+                        help="documents to submit (default: desktop/data/print_jobs/*/*)")
+    parser.add_argument('--seed', type=int, default=1, help="seed for the request sequence")
+    parser.add_argument('--json', dest='json_path', default='load_test.json',
+                        help="file to write the results to")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    paths = args.files or sorted(glob.glob(os.path.join(DESKTOP, 'data', 'print_jobs', '*', '*')))
+    documents = []
+    for path in paths:
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                documents.append((os.path.basename(path), f.read()))
+    if not documents:
+        parser.error("no documents to submit")
+    json_path = os.path.abspath(args.json_path)
+    started_at = datetime.now().isoformat()
+
+    workdir = tempfile.mkdtemp(prefix='xerox-load-')
+    try:
+        levels = []
+        for storage in args.storage:
+            levels.extend(run_backend(storage, args, mix, documents, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(json_path, 'w') as f:
+        json.dump({
+            'commit': current_commit(),
+            'started_at': started_at,
+            'duration': args.duration,
+            'mix': mix,
+            'shops': args.shops,
+            'documents': [name for name, _ in documents],
+            'seed': args.seed,
+            'runs': levels
+        }, f, indent=2)
+    print(f"Results in {json_path}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--serve':
+        serve(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -0,0 +1,84 @@
+"""Compare QR codes for the JSON and the compact shop payloads
+
+For every shop in desktop/data/shops.json (or --shops), builds both payload
+forms and reports payload length, QR version (the symbol is 17 + 4 * version
+modules across), PNG and SVG size and the time to lay out the code and
+render the PNG, as the generator does.
+
+    python benchmarks/qr_payload.py --repeat 20
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'desktop'))
+
+from qr_payload import build_payload, make_qr, png_image, svg_image
+
+
+def measure(payload, repeat):
+    """Version, PNG/SVG bytes and median generation time of one payload's QR code"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        qr = make_qr(payload)
+        png = io.BytesIO()
+        png_image(qr).save(png)
+        times.append(time.perf_counter() - start)
+
+    svg = io.BytesIO()
+    svg_image(qr).save(svg)
+    return {
+        'payload_bytes': len(payload.encode('utf-8')),
+        'version': qr.version,
+        'png_bytes': len(png.getvalue()),
+        'svg_bytes': len(svg.getvalue()),
+        'generate_ms': round(statistics.median(times) * 1000, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compact vs JSON QR payloads")
+    parser.add_argument('--shops', default=os.path.join(ROOT, 'desktop', 'data', 'shops.json'),
+                        help="shops.json-style file to take shop ids, names and URLs from")
+    parser.add_argument('--repeat', type=int, default=10, help="generations per payload")
+    parser.add_argument('--json', dest='json_path', help="also write the results to this file")
+    args = parser.parse_args()
+
+    with open(args.shops, 'r') as f:
+        shops = json.load(f)
+
+    results = []
+    for shop in shops:
+        result = {'shop_id': shop['shop_id']}
+        for name, compact in (('json', False), ('compact', True)):
+            payload = build_payload(shop['shop_id'], shop['server_url'], shop.get('shop_name'), compact)
+            result[name] = measure(payload, args.repeat)
+        results.append(result)
+
+    columns = ('payload_bytes', 'version', 'png_bytes', 'svg_bytes', 'generate_ms')
+    print(f"{'shop':16} {'form':8}" + ''.join(f" {column:>14}" for column in columns))
+    for result in results:
+        for name in ('json', 'compact'):
+            print(f"{result['shop_id'][:16]:16} {name:8}" +
+                  ''.join(f" {result[name][column]:>14}" for column in columns))
+
+    print()
+    for column in columns:
+        before = statistics.mean(result['json'][column] for result in results)
+        after = statistics.mean(result['compact'][column] for result in results)
+        print(f"mean {column:14} json {before:10.2f}  compact {after:10.2f}  "
+              f"({100 * (after - before) / before:+.1f}%)")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'repeat': args.repeat, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
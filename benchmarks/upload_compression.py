@@ -0,0 +1,156 @@
+"""Measure what upload compression saves between the relay and the print server
+
+Starts the print server on a copy of desktop/data in a temp directory, then
+submits each sample document uncompressed and with every Content-Encoding the
+relay supports, over an uplink throttled to --mbps. Reports bytes on the wire,
+the saving and the end-to-end latency of each submission, plus the encoding
+the relay would pick for the file on its own (its compressibility sample).
+
+    python benchmarks/upload_compression.py --mbps 10 --repeat 3
+"""
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DESKTOP = os.path.join(ROOT, 'desktop')
+USER_SIDE = os.path.join(ROOT, 'user side')
+sys.path.insert(0, DESKTOP)
+sys.path.insert(0, USER_SIDE)
+
+import requests
+from werkzeug.serving import make_server
+
+from upload_relay import UPLOAD_ENCODINGS, choose_encoding, encode_chunks, multipart_body
+
+SAMPLE_SIZE = 64 * 1024
+
+
+def start_print_server(workdir):
+    """Run desktop/flask-api-server.py on a copy of its data, returns its URL"""
+    shutil.copytree(os.path.join(DESKTOP, 'data'), os.path.join(workdir, 'data'))
+    shutil.copytree(os.path.join(DESKTOP, 'templates'), os.path.join(workdir, 'templates'))
+    os.chdir(workdir)
+
+    spec = importlib.util.spec_from_file_location('print_server',
+                                                  os.path.join(DESKTOP, 'flask-api-server.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    server = make_server('127.0.0.1', 0, module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", module
+
+
+def throttled(chunks, bytes_per_second, counter):
+    """Pass chunks through at no more than bytes_per_second, counting them"""
+    start = time.monotonic()
+    for chunk in chunks:
+        counter[0] += len(chunk)
+        if bytes_per_second:
+            delay = start + counter[0] / bytes_per_second - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        yield chunk
+
+
+def submit(session, server_url, shop_id, path, encoding, bytes_per_second):
+    """Submit one document, returns (bytes sent, seconds)"""
+    boundary = uuid.uuid4().hex
+    headers = {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+
+    counter = [0]
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        body = multipart_body(boundary, {'shop_id': shop_id}, os.path.basename(path), None,
+                              iter(lambda: f.read(64 * 1024), b''))
+        response = session.post(f"{server_url}/api/submit-print-job",
+                                data=throttled(encode_chunks(body, encoding), bytes_per_second, counter),
+                                headers=headers)
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    return counter[0], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compressed uploads to the print server")
+    parser.add_argument('--files', nargs='*',
+                        help="documents to send (default: desktop/data/print_jobs/*/*)")
+    parser.add_argument('--mbps', type=float, default=10,
+                        help="simulated uplink in megabits per second, 0 for unthrottled")
+    parser.add_argument('--repeat', type=int, default=3, help="submissions per file and encoding")
+    parser.add_argument('--json', dest='json_path', help="also write the results to this file")
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(DESKTOP, 'data', 'print_jobs', '*', '*')))
+    files = [os.path.abspath(path) for path in files if os.path.isfile(path)]
+    bytes_per_second = args.mbps * 1000 * 1000 / 8
+
+    workdir = tempfile.mkdtemp(prefix='xerox-bench-')
+    try:
+        server_url, server = start_print_server(workdir)
+        shop_id = server.storage.list_shops()[0]['shop_id']
+        session = requests.Session()
+        encodings = (None,) + UPLOAD_ENCODINGS
+
+        results = []
+        for path in files:
+            with open(path, 'rb') as f:
+                sample = f.read(SAMPLE_SIZE)
+            result = {
+                'file': os.path.relpath(path, ROOT),
+                'size': os.path.getsize(path),
+                'auto': choose_encoding(sample, UPLOAD_ENCODINGS) or 'identity',
+                'encodings': {}
+            }
+            for encoding in encodings:
+                runs = [submit(session, server_url, shop_id, path, encoding, bytes_per_second)
+                        for _ in range(args.repeat)]
+                result['encodings'][encoding or 'identity'] = {
+                    'wire_bytes': runs[0][0],
+                    'latency_ms': round(statistics.median(seconds for _, seconds in runs) * 1000, 1)
+                }
+            results.append(result)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    names = [encoding or 'identity' for encoding in encodings]
+    print(f"Uplink: {'unthrottled' if not args.mbps else f'{args.mbps:g} Mbit/s'}, "
+          f"median of {args.repeat} runs")
+    print(f"{'file':52} {'size':>9} {'auto':>8}" +
+          ''.join(f" {name + ' bytes':>14} {'ms':>8}" for name in names))
+    totals = {name: [0, 0.0] for name in names}
+    for result in results:
+        line = f"{result['file'][-52:]:52} {result['size']:>9} {result['auto']:>8}"
+        for name in names:
+            stats = result['encodings'][name]
+            totals[name][0] += stats['wire_bytes']
+            totals[name][1] += stats['latency_ms']
+            line += f" {stats['wire_bytes']:>14} {stats['latency_ms']:>8}"
+        print(line)
+
+    baseline = totals['identity'][0] or 1
+    for name in names:
+        saved = 100 * (1 - totals[name][0] / baseline)
+        print(f"{name:>8}: {totals[name][0]} bytes ({saved:.1f}% saved), "
+              f"{totals[name][1]:.0f} ms total latency")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'mbps': args.mbps, 'repeat': args.repeat, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+
+# Shared by the print server (desktop/) and the relay (user side/); each app
+# passes its own chunk size and size-limit exception
+CHUNK_SIZE = 64 * 1024
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+# Unfinished uploads are dropped after this long without a chunk
+UPLOAD_TTL = 24 * 60 * 60
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload would go over its size limit"""
+
+
+class UploadConflict(Exception):
+    """A chunk or finalize didn't match the upload's current offset"""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class CompletedUpload:
+    """An assembled, checksum-verified upload; commit() moves it into place"""
+
+    def __init__(self, path, size, sha256):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+    def commit(self, final_path):
+        os.replace(self.path, final_path)
+        self.path = None
+
+    def abort(self):
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+
+class UploadSessions:
+    """Resumable uploads, kept on disk
+
+    Each upload is an <id>.json file with what the client declared when it
+    created the session (size, sha256 and the job fields) and an <id>.part
+    file with the bytes received so far. The offset to resume from is simply
+    the length of the .part file, which is fsync'd after every chunk, so an
+    upload carries on where it stopped after either end restarts.
+
+    too_large is the exception raised for uploads over max_bytes, so each
+    app can use the one its handlers already catch.
+    """
+
+    def __init__(self, root, max_bytes=None, ttl=UPLOAD_TTL, chunk_size=CHUNK_SIZE,
+                 too_large=UploadTooLarge):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.chunk_size = chunk_size
+        self.too_large = too_large
+        os.makedirs(root, exist_ok=True)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._last_prune = 0
+
+    def _lock(self, upload_id):
+        with self._locks_guard:
+            lock = self._locks.get(upload_id)
+            if lock is None:
+                lock = self._locks[upload_id] = threading.Lock()
+            return lock
+
+    def _forget_lock(self, upload_id):
+        with self._locks_guard:
+            self._locks.pop(upload_id, None)
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.root, f"{upload_id}.json")
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.root, f"{upload_id}.part")
+
+    def _done_path(self, upload_id):
+        return os.path.join(self.root, f"{upload_id}.done")
+
+    def create(self, size, sha256=None, **fields):
+        """Start an upload of size bytes; returns the new session"""
+        if not isinstance(size, int) or size < 0:
+            raise ValueError("size must be a non-negative number of bytes")
+        if self.max_bytes is not None and size > self.max_bytes:
+            raise self.too_large(f"File is larger than {self.max_bytes} bytes")
+
+        if time.monotonic() - self._last_prune > 60 * 60:
+            self.prune()
+
+        upload_id = uuid.uuid4().hex
+        session = dict(fields, upload_id=upload_id, size=size, sha256=sha256,
+                       created_at=datetime.now().isoformat())
+        open(self._part_path(upload_id), 'wb').close()
+        self._save(session)
+        session['offset'] = 0
+        return session
+
+    def get(self, upload_id):
+        """Return the session with its current offset, or None"""
+        if not UPLOAD_ID_RE.match(upload_id):
+            return None
+        try:
+            with open(self._meta_path(upload_id), 'r') as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            session['offset'] = os.path.getsize(self._part_path(upload_id))
+        except OSError:
+            session['offset'] = session['size'] if 'result' in session else 0
+        return session
+
+    def write(self, upload_id, offset, stream):
+        """Append a chunk read from stream at offset; returns the new offset
+
+        Raises KeyError for an unknown upload, UploadConflict if offset isn't
+        where the upload is and too_large if the chunk runs past the declared
+        size. Whatever arrives before the client disconnects is kept.
+        """
+        with self._lock(upload_id):
+            session = self.get(upload_id)
+            if session is None or 'result' in session:
+                raise KeyError(upload_id)
+            if offset != session['offset']:
+                raise UploadConflict(session['offset'])
+
+            remaining = session['size'] - offset
+            with open(self._part_path(upload_id), 'ab') as f:
+                try:
+                    while True:
+                        chunk = stream.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        if len(chunk) > remaining:
+                            f.truncate(offset)
+                            raise self.too_large(f"Chunk goes past the declared size of "
+                                                 f"{session['size']} bytes")
+                        f.write(chunk)
+                        remaining -= len(chunk)
+                finally:
+                    f.flush()
+                    os.fsync(f.fileno())
+            return session['size'] - remaining
+
+    def complete(self, upload_id, sha256=None):
+        """Check the assembled file and hand it over as a CompletedUpload
+
+        The file must be complete and, if a sha256 was given now or when the
+        upload was created, match it; on a mismatch the received bytes are
+        dropped so the client can send them again. Raises KeyError,
+        UploadConflict (not all bytes received) or ValueError.
+        """
+        with self._lock(upload_id):
+            session = self.get(upload_id)
+            if session is None or 'result' in session:
+                raise KeyError(upload_id)
+            if session['offset'] != session['size']:
+                raise UploadConflict(session['offset'])
+
+            part_path = self._part_path(upload_id)
+            digest = hashlib.sha256()
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                    digest.update(chunk)
+
+            expected = sha256 or session.get('sha256')
+            if expected and digest.hexdigest() != expected.lower():
+                open(part_path, 'wb').close()
+                raise ValueError("Checksum mismatch, the upload has to be sent again")
+
+            # Moved aside so a second finalize can't use the same bytes
+            done_path = self._done_path(upload_id)
+            os.replace(part_path, done_path)
+            return CompletedUpload(done_path, session['size'], digest.hexdigest())
+
+    def finish(self, upload_id, result):
+        """Record what a completed upload turned into, so finalize can be repeated"""
+        session = self.get(upload_id)
+        if session is not None:
+            session.pop('offset', None)
+            session['result'] = result
+            self._save(session)
+        # Chunks and finalize no longer touch the file, so its lock can go
+        self._forget_lock(upload_id)
+
+    def remove(self, upload_id):
+        with self._lock(upload_id):
+            for path in (self._meta_path(upload_id), self._part_path(upload_id),
+                         self._done_path(upload_id)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self._forget_lock(upload_id)
+
+    def prune(self):
+        """Delete uploads that haven't been touched for ttl seconds
+
+        That includes the .done file left behind when finalize stopped
+        between complete() and finish().
+        """
+        self._last_prune = time.monotonic()
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.root):
+            upload_id, ext = os.path.splitext(name)
+            if ext == '.done' and not os.path.exists(self._meta_path(upload_id)):
+                try:
+                    if os.path.getmtime(self._done_path(upload_id)) < cutoff:
+                        os.remove(self._done_path(upload_id))
+                except OSError:
+                    pass
+                continue
+            if ext != '.json':
+                continue
+            times = []
+            for path in (self._meta_path(upload_id), self._part_path(upload_id),
+                         self._done_path(upload_id)):
+                try:
+                    times.append(os.path.getmtime(path))
+                except OSError:
+                    pass
+            if times and max(times) < cutoff:
+                self.remove(upload_id)
+
+    def _save(self, session):
+        path = self._meta_path(session['upload_id'])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(session, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
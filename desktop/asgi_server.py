@@ -0,0 +1,214 @@
+import asyncio
+import re
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+# Request bodies larger than this are spooled to a temp file instead of memory
+SPOOL_MEMORY_SIZE = 1024 * 1024
+EVENTS_PATH_RE = re.compile(r'^/api/shops/([^/]+)/events$')
+
+
+class ClientDisconnected(Exception):
+    """The client went away before sending the whole request body"""
+
+
+class AsyncPrintServer:
+    """ASGI front end for the Flask print API
+
+    The request body is read from the client on the event loop, so a slow
+    mobile upload costs a coroutine rather than a worker thread. Once the body
+    is complete the request is handed to the unchanged Flask (WSGI) app on a
+    bounded thread pool, which keeps routes and JSON contracts identical to the
+    WSGI mode. Spilling large bodies to disk also runs on that pool.
+
+    Shop event streams are served directly on the event loop from the
+    EventBroker, so idle subscribers don't hold a thread each.
+    """
+
+    def __init__(self, wsgi_app, event_broker, max_workers=16, max_body_size=None,
+                 keepalive=15):
+        self.wsgi_app = wsgi_app
+        self.event_broker = event_broker
+        self.max_body_size = max_body_size
+        self.keepalive = keepalive
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='asgi-worker')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        match = EVENTS_PATH_RE.match(scope['path'])
+        if match and scope['method'] == 'GET':
+            await self._events(scope, receive, send, match.group(1))
+            return
+
+        try:
+            body = await self._read_body(receive)
+        except ClientDisconnected:
+            return
+        if body is None:
+            await _send_simple(send, 413, b'{"error": "Request body too large"}')
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+            environ = _build_environ(scope, body)
+            status, headers, chunks = await loop.run_in_executor(
+                self.executor, self._call_wsgi, environ)
+        finally:
+            body.close()
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        """Read the request body without blocking, None if it is too large"""
+        loop = asyncio.get_running_loop()
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE)
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                raise ClientDisconnected()
+            chunk = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            size += len(chunk)
+            if self.max_body_size is not None and size > self.max_body_size:
+                body.close()
+                return None
+            if size > SPOOL_MEMORY_SIZE:
+                # Past max_size the spooled file writes to disk (this write rolls it over)
+                await loop.run_in_executor(self.executor, body.write, chunk)
+            else:
+                body.write(chunk)
+        body.seek(0)
+        return body
+
+    def _call_wsgi(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            chunks = list(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], chunks
+
+    async def _events(self, scope, receive, send, shop_id):
+        headers = dict(scope['headers'])
+        last_event_id = headers.get(b'last-event-id', b'').decode('latin-1')
+        if not last_event_id:
+            query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+            last_event_id = query.get('last_event_id', [''])[0]
+
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        subscription = self.event_broker.subscribe(shop_id, last_event_id or None)
+        subscription.set_waker(lambda: loop.call_soon_threadsafe(wake.set))
+        disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+                (b'access-control-allow-origin', b'*'),
+            ]})
+            await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+
+            while not disconnected.done():
+                waiter = asyncio.ensure_future(wake.wait())
+                await asyncio.wait({waiter, disconnected}, timeout=self.keepalive,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if disconnected.done():
+                    break
+
+                wake.clear()
+                events = subscription.get(timeout=0)
+                payload = ''.join(event.encode() for event in events) or ': keep-alive\n\n'
+                await send({'type': 'http.response.body', 'body': payload.encode(),
+                            'more_body': True})
+        finally:
+            subscription.close()
+            disconnected.cancel()
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def _send_simple(send, status, body):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _build_environ(scope, body):
+    """Translate an ASGI HTTP scope plus a buffered body into a WSGI environ"""
+    body.seek(0, 2)
+    content_length = body.tell()
+    body.seek(0)
+
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(content_length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name in ('CONTENT_LENGTH', 'TRANSFER_ENCODING'):
+            # The body has been read in full, so its length is known
+            continue
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
@@ -0,0 +1,93 @@
+import os
+import re
+import threading
+
+from store_writer import fsync_dir
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobStore:
+    """Content-addressed store for uploaded documents
+
+    Each distinct file is stored once as <root>/<sha[:2]>/<sha>, with a
+    <sha>.refs file next to it counting the print jobs that use it. Uploads are
+    streamed into <root>/incoming first (same filesystem, so adding a blob is a
+    rename) and dropped if an identical blob already exists.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.incoming_dir = os.path.join(root, 'incoming')
+        os.makedirs(self.incoming_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def path(self, sha256):
+        if not SHA256_RE.match(sha256 or ''):
+            raise ValueError(f"Invalid blob hash: {sha256}")
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def _refs_path(self, sha256):
+        return self.path(sha256) + '.refs'
+
+    def size(self, sha256):
+        """Return the blob's size in bytes, or None if it isn't stored"""
+        try:
+            return os.path.getsize(self.path(sha256))
+        except (OSError, ValueError):
+            return None
+
+    def add(self, uploaded):
+        """Store a streamed upload and take a reference to it, returns its path"""
+        sha256 = uploaded.sha256
+        path = self.path(sha256)
+        with self._lock:
+            if os.path.exists(path):
+                uploaded.abort()
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                uploaded.commit(path)
+                fsync_dir(os.path.dirname(path))
+            self._set_refs(sha256, self._get_refs(sha256) + 1)
+        return path
+
+    def acquire(self, sha256):
+        """Take another reference to a stored blob, returns its path
+
+        Raises KeyError if the blob isn't stored.
+        """
+        path = self.path(sha256)
+        with self._lock:
+            if not os.path.exists(path):
+                raise KeyError(sha256)
+            self._set_refs(sha256, self._get_refs(sha256) + 1)
+        return path
+
+    def release(self, sha256):
+        """Drop a reference, deleting the blob when nothing uses it"""
+        with self._lock:
+            refs = self._get_refs(sha256) - 1
+            if refs > 0:
+                self._set_refs(sha256, refs)
+                return
+            for path in (self.path(sha256), self._refs_path(sha256)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _get_refs(self, sha256):
+        try:
+            with open(self._refs_path(sha256), 'r') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _set_refs(self, sha256, refs):
+        refs_path = self._refs_path(sha256)
+        tmp_path = f"{refs_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(str(refs))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, refs_path)
@@ -1,10 +1,24 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory
 import os
+import sys
 import json
 import base64
+import hashlib
 from datetime import datetime
 import uuid
+import argparse
+from urllib.parse import urlparse
 from flask_cors import CORS  # Add CORS support for cross-domain requests
+# Modules shared with the relay
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from storage import open_storage
+from blob_store import BlobStore
+from job_events import EventBroker
+from upload_stream import CHUNK_SIZE, UPLOAD_ENCODINGS, UnsupportedEncoding, UploadTooLarge, decode_body, parse_upload
+from upload_sessions import UploadConflict, UploadSessions
+from qr_cache import QRCodeCache, payload_version
+from qr_payload import shop_payload
+from qr_store import GC_INTERVAL, GC_RATE, QRImageStore
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -12,169 +26,480 @@ CORS(app)  # Enable CORS for all routes
 # Configuration
 UPLOAD_FOLDER = 'static/qr_codes'
 SHOPS_DATA_FILE = 'data/shops.json'
+PRINT_JOBS_FOLDER = 'data/print_jobs'
+# Uploaded documents are stored once per distinct content, keyed by SHA-256
+BLOB_FOLDER = 'data/blobs'
+# Resumable uploads in progress (same filesystem as the blobs)
+UPLOAD_SESSIONS_FOLDER = 'data/uploads'
+# 'json' (shops.json + job journals) or 'sqlite' (data/xerox.db)
+STORAGE_BACKEND = os.environ.get('XEROX_STORAGE', 'json')
+app.config['MAX_UPLOAD_BYTES'] = int(os.environ.get('XEROX_MAX_UPLOAD_MB', '64')) * 1024 * 1024
+# Most documents one batch submission may carry
+MAX_BATCH_FILES = 50
+# Most shops one bulk registration may carry
+MAX_BATCH_SHOPS = 500
+JOBS_PAGE_SIZE = 50
+# QR images whose URL is versioned (?v=<payload hash>) never change
+QR_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+QR_MIN_SIZE = 64
+QR_MAX_SIZE = 2048
+# Unreferenced QR images are collected every XEROX_QR_GC_INTERVAL seconds,
+# at most XEROX_QR_GC_RATE deletions per second
+QR_GC_INTERVAL = int(os.environ.get('XEROX_QR_GC_INTERVAL', str(GC_INTERVAL)))
+QR_GC_RATE = int(os.environ.get('XEROX_QR_GC_RATE', str(GC_RATE)))
+MAX_JOBS_PAGE_SIZE = 200
+
+# Allowed job status changes: pending -> printing -> completed/failed
+JOB_TRANSITIONS = {
+    'pending': {'printing', 'failed'},
+    'printing': {'completed', 'failed'},
+}
+JOB_STATUSES = {'pending', 'printing', 'completed', 'failed'}
+
+# Seconds between keep-alive comments on idle event streams
+SSE_KEEPALIVE = 15
 
 # Ensure directories exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs('data', exist_ok=True)
-os.makedirs('data/print_jobs', exist_ok=True)
+os.makedirs(PRINT_JOBS_FOLDER, exist_ok=True)
 
 # Initialize shops data if it doesn't exist
 if not os.path.exists(SHOPS_DATA_FILE):
     with open(SHOPS_DATA_FILE, 'w') as f:
         json.dump([], f)
 
-# Load shops data
-def load_shops():
-    try:
-        with open(SHOPS_DATA_FILE, 'r') as f:
-            return json.load(f)
-    except:
-        return []
+storage = open_storage(STORAGE_BACKEND, 'data')
+blob_store = BlobStore(BLOB_FOLDER)
+upload_sessions = UploadSessions(UPLOAD_SESSIONS_FOLDER, app.config['MAX_UPLOAD_BYTES'],
+                                 chunk_size=CHUNK_SIZE, too_large=UploadTooLarge)
+# New jobs and status changes are pushed to shop consoles over SSE
+event_broker = EventBroker()
+qr_cache = QRCodeCache()
 
-# Save shops data
-def save_shops(shops):
-    with open(SHOPS_DATA_FILE, 'w') as f:
-        json.dump(shops, f, indent=2)
+def referenced_qr_images():
+    return {shop.get('qr_code_path') for shop in storage.list_shops()}
+
+# Registered QR images, stored once per distinct content
+qr_store = QRImageStore(UPLOAD_FOLDER, referenced_qr_images, interval=QR_GC_INTERVAL, rate=QR_GC_RATE)
+qr_store.start_collector()
+
+@app.after_request
+def advertise_upload_encodings(response):
+    # Tells clients which request Content-Encodings uploads may use (RFC 7694)
+    response.headers['Accept-Encoding'] = ', '.join(UPLOAD_ENCODINGS)
+    return response
 
 @app.route('/')
 def index():
     """Home page with basic service information"""
     return render_template('index.html')
 
+def save_qr_image(image):
+    """Store a shop's QR code PNG (bytes or an uploaded file), returns its filename"""
+    if not isinstance(image, bytes):
+        image = image.read()
+    return qr_store.add(image)
+
+def shop_upsert(data, qr_filename):
+    """The (shop_id, new_shop, updates) registering data amounts to"""
+    now = datetime.now().isoformat()
+    new_shop = {
+        'shop_id': data['shop_id'],
+        'shop_name': data.get('shop_name', ''),
+        'server_url': data['server_url'],
+        'created_at': now,
+        'qr_code_path': qr_filename
+    }
+    updates = {
+        'shop_name': data.get('shop_name', ''),
+        'server_url': data['server_url'],
+        'updated_at': now
+    }
+    if qr_filename:
+        updates['qr_code_path'] = qr_filename
+    return data['shop_id'], new_shop, updates
+
+def missing_shop_field(data):
+    for field in ('shop_id', 'server_url'):
+        if not data.get(field):
+            return f'Missing required field: {field}'
+    url = urlparse(data['server_url']) if isinstance(data['server_url'], str) else None
+    if url is None or url.scheme not in ('http', 'https') or not url.hostname:
+        return 'server_url must be an http(s) URL with a host'
+    return None
+
 @app.route('/api/register_shop', methods=['POST'])
 def register_shop():
-    """Register a new Xerox shop with QR code"""
+    """Register a new Xerox shop with QR code
+
+    Takes multipart/form-data with the QR code PNG as a qr_code_image file
+    part, or (for older clients) JSON with the PNG base64-encoded.
+    """
     try:
-        data = request.json
+        if request.mimetype == 'multipart/form-data':
+            data = request.form
+            image = request.files.get('qr_code_image')
+        else:
+            data = request.get_json(silent=True) or {}
+            image = base64.b64decode(data['qr_code_image']) if data.get('qr_code_image') else None
         
         # Validate required fields
-        required_fields = ['shop_id', 'server_url']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
+        error = missing_shop_field(data)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Process QR code image if present
-        qr_filename = None
-        if 'qr_code_image' in data and data['qr_code_image']:
-            qr_data = base64.b64decode(data['qr_code_image'])
-            qr_filename = f"qr_{data['shop_id']}_{uuid.uuid4().hex[:8]}.png"
-            qr_path = os.path.join(UPLOAD_FOLDER, qr_filename)
-            
-            with open(qr_path, 'wb') as f:
-                f.write(qr_data)
-        
-        # Load existing shops
-        shops = load_shops()
-        
-        # Check if shop_id already exists
-        for shop in shops:
-            if shop['shop_id'] == data['shop_id']:
-                # Update existing shop
-                shop.update({
-                    'shop_name': data.get('shop_name', ''),
-                    'server_url': data['server_url'],
-                    'updated_at': datetime.now().isoformat()
-                })
-                
-                if qr_filename:
-                    shop['qr_code_path'] = qr_filename
-                
-                save_shops(shops)
-                return jsonify({'message': 'Shop updated successfully', 'shop_id': data['shop_id']}), 200
-        
-        # Create new shop record
-        new_shop = {
-            'shop_id': data['shop_id'],
-            'shop_name': data.get('shop_name', ''),
-            'server_url': data['server_url'],
-            'created_at': datetime.now().isoformat(),
-            'qr_code_path': qr_filename
-        }
+        qr_filename = save_qr_image(image) if image else None
         
-        shops.append(new_shop)
-        save_shops(shops)
+        # Create or update the shop record
+        created = storage.upsert_shop(*shop_upsert(data, qr_filename))
+        if not created:
+            return jsonify({'message': 'Shop updated successfully', 'shop_id': data['shop_id']}), 200
         
         return jsonify({'message': 'Shop registered successfully', 'shop_id': data['shop_id']}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/register_shops', methods=['POST'])
+def register_shops():
+    """Register many shops in one request and one registry write
+
+    multipart/form-data with a shops field holding a JSON list of
+    {shop_id, shop_name, server_url} objects; the QR code PNG of the shop at
+    index i, if any, is the file part qr_<i>. Each shop gets its own result.
+    """
+    try:
+        shops = json.loads(request.form.get('shops') or 'null')
+    except ValueError:
+        shops = None
+    if not isinstance(shops, list):
+        return jsonify({'error': 'shops must be a JSON list'}), 400
+    if len(shops) > MAX_BATCH_SHOPS:
+        return jsonify({'error': f'At most {MAX_BATCH_SHOPS} shops per request'}), 400
+
+    results = []
+    items = []
+    for index, data in enumerate(shops):
+        error = missing_shop_field(data) if isinstance(data, dict) else 'Shop must be an object'
+        if error:
+            results.append({'index': index, 'shop_id': data.get('shop_id') if isinstance(data, dict) else None,
+                            'error': error})
+            continue
+        try:
+            image = request.files.get(f'qr_{index}')
+            qr_filename = save_qr_image(image) if image else None
+        except OSError as e:
+            results.append({'index': index, 'shop_id': data['shop_id'], 'error': str(e)})
+            continue
+        items.append(shop_upsert(data, qr_filename))
+        results.append({'index': index, 'shop_id': data['shop_id']})
+
+    if items:
+        try:
+            created = storage.upsert_shops(items)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        done = iter(created)
+        for result in results:
+            if 'error' not in result:
+                result['created'] = next(done)
+
+    registered = len(items)
+    return jsonify({
+        'message': f'{registered} of {len(results)} shops registered',
+        'registered': registered,
+        'failed': len(results) - registered,
+        'results': results
+    }), 200 if registered or not results else 400
+
+@app.route('/api/shops/<shop_id>/qr.<any(png, svg):fmt>', methods=['GET'])
+def get_shop_qr(shop_id, fmt):
+    """Render a shop's QR code from its registry entry (?size= PNG width in pixels)
+
+    With ?v= matching the current payload hash the URL is immutable and is
+    cached for a year; without it clients revalidate with the ETag.
+    """
+    shop = storage.get_shop(shop_id)
+    if shop is None:
+        return jsonify({'error': 'Unknown shop'}), 404
+    size = request.args.get('size')
+    if size is not None:
+        try:
+            size = int(size)
+        except ValueError:
+            return jsonify({'error': 'size must be an integer'}), 400
+        if not QR_MIN_SIZE <= size <= QR_MAX_SIZE:
+            return jsonify({'error': f'size must be between {QR_MIN_SIZE} and {QR_MAX_SIZE}'}), 400
+
+    try:
+        payload = shop_payload(shop)
+    except ValueError as e:
+        return jsonify({'error': f'Shop record cannot be encoded: {e}'}), 422
+    etag = qr_cache.etag(payload, fmt, size if fmt == 'png' else None)
+    if request.args.get('v') == payload_version(payload):
+        cache_control = f'public, max-age={QR_CACHE_MAX_AGE}, immutable'
+    else:
+        cache_control = 'public, no-cache'
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(qr_cache.get(payload, fmt, size),
+                            mimetype='image/png' if fmt == 'png' else 'image/svg+xml')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def shops_etag(shops):
+    """Version tag for the whole shop list"""
+    return hashlib.sha1(json.dumps(shops, sort_keys=True).encode('utf-8')).hexdigest()
+
+def shop_changed_at(shop):
+    return max(shop.get('updated_at') or '', shop.get('created_at') or '')
+
+@app.route('/api/qr_codes/stats', methods=['GET'])
+def qr_code_stats():
+    """Stored QR images and what garbage collection has reclaimed"""
+    return jsonify(qr_store.stats()), 200
+
 @app.route('/api/shops', methods=['GET'])
 def get_shops():
-    """Get list of registered shops"""
-    shops = load_shops()
-    return jsonify(shops)
+    """Get list of registered shops
+
+    The ETag covers the whole list, so If-None-Match answers 304 when no shop
+    has changed. ?changed_since=<ISO time> returns only the shops created or
+    updated at or after that time (still tagged with the full list's ETag).
+    """
+    shops = storage.list_shops()
+    etag = shops_etag(shops)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    since = request.args.get('changed_since')
+    if since:
+        shops = [shop for shop in shops if shop_changed_at(shop) >= since]
+    response = jsonify(shops)
+    response.set_etag(etag)
+    return response
+
+@app.route('/api/shops/<shop_id>', methods=['GET'])
+def get_shop(shop_id):
+    """Get one registered shop (supports If-None-Match)"""
+    shop = storage.get_shop(shop_id)
+    if shop is None:
+        return jsonify({'error': 'Unknown shop'}), 404
+    response = jsonify(shop)
+    response.add_etag()
+    return response.make_conditional(request)
+
+def encode_cursor(job):
+    key = json.dumps([job.get('created_at', ''), job['job_id']])
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    created_at, job_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    return (str(created_at), str(job_id))
+
+@app.route('/api/shops/<shop_id>/jobs', methods=['GET'])
+def list_shop_jobs(shop_id):
+    """Page through a shop's jobs, newest first"""
+    try:
+        limit = min(int(request.args.get('limit', JOBS_PAGE_SIZE)), MAX_JOBS_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        before = decode_cursor(cursor) if cursor else None
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    if limit < 1:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    
+    # Fetch one extra job to know whether there is another page
+    jobs = storage.query_jobs(shop_id,
+                              status=request.args.get('status') or None,
+                              since=request.args.get('since') or None,
+                              until=request.args.get('until') or None,
+                              before=before,
+                              limit=limit + 1)
+    next_cursor = encode_cursor(jobs[limit - 1]) if len(jobs) > limit else None
+    
+    return jsonify({'jobs': jobs[:limit], 'next_cursor': next_cursor})
+
+def check_transition(job, fields):
+    """Return an error message if the status change isn't allowed"""
+    current = job.get('status', 'pending')
+    if fields['status'] not in JOB_TRANSITIONS.get(current, ()):
+        return f"Cannot change job from {current} to {fields['status']}"
+    return None
+
+def change_job_statuses(updates):
+    """Validate and apply [(job_id, status)] in a single store write"""
+    now = datetime.now().isoformat()
+    changes = [(job_id, {'status': status, 'updated_at': now}) for job_id, status in updates]
+    results = storage.update_jobs(changes, check=check_transition)
+    for _, job, error in results:
+        if job is not None and not error:
+            event_broker.publish(job['shop_id'], 'job_updated', job)
+    return results
+
+@app.route('/api/jobs/<job_id>', methods=['PATCH'])
+def update_job_status(job_id):
+    """Move a job to a new status"""
+    data = request.get_json(silent=True) or {}
+    status = data.get('status')
+    if status not in JOB_STATUSES:
+        return jsonify({'error': f'Invalid status: {status}'}), 400
+    
+    [(_, job, error)] = change_job_statuses([(job_id, status)])
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if error:
+        return jsonify({'error': error}), 409
+    
+    return jsonify({'message': 'Job updated successfully', 'job': job}), 200
+
+@app.route('/api/jobs', methods=['PATCH'])
+def update_job_statuses():
+    """Bulk status change: {"job_ids": [...], "status": ...} or {"updates": [{"job_id", "status"}]}"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Body must be a JSON object'}), 400
+    if 'updates' in data:
+        items = data['updates']
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            return jsonify({'error': 'updates must be a list of objects'}), 400
+        updates = [(item.get('job_id'), item.get('status')) for item in items]
+    else:
+        job_ids = data.get('job_ids', [])
+        if not isinstance(job_ids, list) or not all(isinstance(job_id, str) for job_id in job_ids):
+            return jsonify({'error': 'job_ids must be a list of strings'}), 400
+        updates = [(job_id, data.get('status')) for job_id in job_ids]
+    
+    if not updates:
+        return jsonify({'error': 'No jobs to update'}), 400
+    for job_id, status in updates:
+        if not isinstance(job_id, str) or not job_id or not isinstance(status, str) or status not in JOB_STATUSES:
+            return jsonify({'error': f'Invalid update for job {job_id}: status {status}'}), 400
+    
+    results = []
+    for job_id, job, error in change_job_statuses(updates):
+        if job is None:
+            results.append({'job_id': job_id, 'updated': False, 'error': 'Job not found'})
+        elif error:
+            results.append({'job_id': job_id, 'updated': False, 'error': error})
+        else:
+            results.append({'job_id': job_id, 'updated': True, 'status': job['status']})
+    
+    return jsonify({'results': results}), 200
+
+@app.route('/api/shops/<shop_id>/events', methods=['GET'])
+def shop_events(shop_id):
+    """Server-Sent Events stream of job_created / job_updated events for a shop"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscription = event_broker.subscribe(shop_id, last_event_id)
+    
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                events = subscription.get(timeout=SSE_KEEPALIVE)
+                if not events:
+                    yield ': keep-alive\n\n'
+                for event in events:
+                    yield event.encode()
+        finally:
+            subscription.close()
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/blobs/<sha256>', methods=['GET', 'HEAD'])
+def get_blob(sha256):
+    """Pre-upload check: does the server already have this document?"""
+    size = blob_store.size(sha256)
+    if size is None:
+        return jsonify({'error': 'Unknown blob'}), 404
+    return jsonify({'sha256': sha256, 'size': size}), 200
+
+def new_job(shop_id, filename, file_path, sha256, copies, color, paper_size):
+    """Build the record of a pending print job for a stored blob"""
+    return {
+        'job_id': f"job_{uuid.uuid4().hex}",
+        'shop_id': shop_id,
+        'filename': filename,
+        'file_path': file_path,
+        'copies': copies,
+        'color': color,
+        'paper_size': paper_size,
+        'size': os.path.getsize(file_path),
+        'sha256': sha256,
+        'status': 'pending',
+        'created_at': datetime.now().isoformat()
+    }
+
+def save_job(shop_id, filename, file_path, sha256, copies, color, paper_size):
+    """Record a print job for a stored blob (already referenced) and announce it"""
+    job_details = new_job(shop_id, filename, file_path, sha256, copies, color, paper_size)
+    try:
+        storage.add_job(job_details)
+    except Exception:
+        blob_store.release(sha256)
+        raise
+    event_broker.publish(shop_id, 'job_created', job_details)
+    return job_details['job_id']
 
 @app.route('/api/submit-print-job', methods=['POST'])
 def submit_print_job():
     """Endpoint for mobile app to submit print jobs"""
+    # Stream the body to disk ourselves instead of letting Werkzeug spool it
+    try:
+        upload = parse_upload(decode_body(request.stream, request.headers.get('Content-Encoding')),
+                              request.content_type,
+                              blob_store.incoming_dir,
+                              app.config['MAX_UPLOAD_BYTES'],
+                              max_files=1)
+    except UnsupportedEncoding as e:
+        return jsonify({'error': str(e)}), 415
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
         # Get form data
-        shop_id = request.form.get('shop_id')
-        copies = request.form.get('copies', 1)
-        color = request.form.get('color', 'false').lower() == 'true'
-        paper_size = request.form.get('paper_size', 'A4')
+        shop_id = upload.fields.get('shop_id')
+        copies = upload.fields.get('copies', 1)
+        color = upload.fields.get('color', 'false').lower() == 'true'
+        paper_size = upload.fields.get('paper_size', 'A4')
         
-        # Get file
-        if 'file' not in request.files:
+        # Get file, or a reference to a document the server already has
+        file = upload.file('file')
+        blob_sha256 = upload.fields.get('blob_sha256')
+        if file is None and not blob_sha256:
             return jsonify({'error': 'No file part'}), 400
-            
-        file = request.files['file']
         
-        if file.filename == '':
+        filename = file.filename if file is not None else upload.fields.get('filename', '')
+        if filename == '':
             return jsonify({'error': 'No selected file'}), 400
             
         # Validate shop_id
-        shops = load_shops()
-        shop_found = False
-        for shop in shops:
-            if shop['shop_id'] == shop_id:
-                shop_found = True
-                break
-                
-        if not shop_found:
+        if storage.get_shop(shop_id) is None:
             return jsonify({'error': 'Invalid shop ID'}), 400
             
-        # Create print jobs directory if it doesn't exist
-        print_jobs_dir = os.path.join('data', 'print_jobs', shop_id)
-        os.makedirs(print_jobs_dir, exist_ok=True)
-        
-        # Save file
-        job_id = f"job_{uuid.uuid4().hex}"
-        file_ext = os.path.splitext(file.filename)[1]
-        save_filename = f"{job_id}{file_ext}"
-        file_path = os.path.join(print_jobs_dir, save_filename)
-        file.save(file_path)
-        
-        # Save job details
-        job_details = {
-            'job_id': job_id,
-            'shop_id': shop_id,
-            'filename': file.filename,
-            'file_path': file_path,
-            'copies': copies,
-            'color': color,
-            'paper_size': paper_size,
-            'status': 'pending',
-            'created_at': datetime.now().isoformat()
-        }
-        
-        jobs_file = os.path.join('data', 'print_jobs', f"{shop_id}_jobs.json")
-        
-        # Load existing jobs
-        jobs = []
-        if os.path.exists(jobs_file):
-            with open(jobs_file, 'r') as f:
-                try:
-                    jobs = json.load(f)
-                except:
-                    jobs = []
-        
-        jobs.append(job_details)
+        # Store the document (or reuse the identical copy we already have)
+        if file is not None:
+            blob_sha256 = file.sha256
+            file_path = blob_store.add(file)
+        else:
+            try:
+                file_path = blob_store.acquire(blob_sha256)
+            except (KeyError, ValueError):
+                return jsonify({'error': 'Unknown blob'}), 404
         
-        # Save updated jobs
-        with open(jobs_file, 'w') as f:
-            json.dump(jobs, f, indent=2)
+        job_id = save_job(shop_id, filename, file_path, blob_sha256, copies, color, paper_size)
             
         return jsonify({
             'message': 'Print job submitted successfully',
@@ -183,39 +508,226 @@ def submit_print_job():
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    finally:
+        upload.discard()
+
+@app.route('/api/submit-print-jobs', methods=['POST'])
+def submit_print_jobs():
+    """Submit several documents to one shop in a single request
+
+    Every file part becomes a job. copies, color and paper_size fields apply
+    to all of them; an options field (a JSON list with one object per file
+    part, in order) can override them and the filename per file. The shop is
+    checked once and all the jobs are recorded in one store write. Each file
+    gets its own result, so one that fails doesn't take the others with it.
+    """
+    try:
+        upload = parse_upload(decode_body(request.stream, request.headers.get('Content-Encoding')),
+                              request.content_type,
+                              blob_store.incoming_dir,
+                              app.config['MAX_UPLOAD_BYTES'],
+                              max_files=MAX_BATCH_FILES)
+    except UnsupportedEncoding as e:
+        return jsonify({'error': str(e)}), 415
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        shop_id = upload.fields.get('shop_id')
+        if storage.get_shop(shop_id) is None:
+            return jsonify({'error': 'Invalid shop ID'}), 400
+        if not upload.files:
+            return jsonify({'error': 'No file part'}), 400
+
+        try:
+            options = json.loads(upload.fields.get('options') or '[]')
+        except ValueError:
+            options = None
+        if not isinstance(options, list):
+            return jsonify({'error': 'options must be a JSON list'}), 400
+
+        defaults = {
+            'copies': upload.fields.get('copies', 1),
+            'color': upload.fields.get('color', 'false'),
+            'paper_size': upload.fields.get('paper_size', 'A4')
+        }
+        results = []
+        jobs = []
+        for index, file in enumerate(upload.files):
+            file_options = options[index] if index < len(options) else {}
+            if not isinstance(file_options, dict):
+                results.append({'index': index, 'filename': file.filename,
+                                'error': 'options must be an object'})
+                continue
+            filename = file_options.get('filename') or file.filename
+            if not filename:
+                results.append({'index': index, 'filename': '', 'error': 'No selected file'})
+                continue
+
+            try:
+                file_path = blob_store.add(file)
+            except Exception as e:
+                results.append({'index': index, 'filename': filename, 'error': str(e)})
+                continue
+
+            job = new_job(shop_id, filename, file_path, file.sha256,
+                          file_options.get('copies', defaults['copies']),
+                          str(file_options.get('color', defaults['color'])).lower() == 'true',
+                          file_options.get('paper_size', defaults['paper_size']))
+            jobs.append(job)
+            results.append({'index': index, 'filename': filename, 'job_id': job['job_id']})
+
+        if jobs:
+            try:
+                storage.add_jobs(jobs)
+            except Exception as e:
+                # Nothing was recorded, so none of the stored files are in use
+                for job in jobs:
+                    blob_store.release(job['sha256'])
+                for result in results:
+                    if 'job_id' in result:
+                        result['error'] = str(e)
+                        del result['job_id']
+                jobs = []
+            for job in jobs:
+                event_broker.publish(shop_id, 'job_created', job)
+
+        return jsonify({
+            'message': f'{len(jobs)} of {len(results)} print jobs submitted',
+            'submitted': len(jobs),
+            'failed': len(results) - len(jobs),
+            'results': results
+        }), 200 if jobs else 400
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        upload.discard()
+
+def upload_view(session):
+    return {'upload_id': session['upload_id'], 'offset': session['offset'], 'size': session['size']}
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """Start a resumable upload; the job fields are given now, the file in chunks"""
+    data = request.get_json(silent=True) or {}
+    if storage.get_shop(data.get('shop_id')) is None:
+        return jsonify({'error': 'Invalid shop ID'}), 400
+    if not data.get('filename'):
+        return jsonify({'error': 'No selected file'}), 400
+
+    try:
+        session = upload_sessions.create(
+            data.get('size'), data.get('sha256'),
+            shop_id=data['shop_id'],
+            filename=data['filename'],
+            copies=data.get('copies', 1),
+            color=str(data.get('color', 'false')).lower() == 'true',
+            paper_size=data.get('paper_size', 'A4')
+        )
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(upload_view(session)), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """How much of an upload has arrived, i.e. the offset to resume from"""
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    return jsonify(upload_view(session))
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    """Append the request body to an upload at ?offset="""
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'error': 'offset must be an integer'}), 400
+
+    try:
+        body = decode_body(request.stream, request.headers.get('Content-Encoding'))
+        new_offset = upload_sessions.write(upload_id, offset, body)
+    except UnsupportedEncoding as e:
+        return jsonify({'error': str(e)}), 415
+    except KeyError:
+        return jsonify({'error': 'Unknown upload'}), 404
+    except UploadConflict as e:
+        return jsonify({'error': str(e), 'upload_id': upload_id, 'offset': e.offset}), 409
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'upload_id': upload_id, 'offset': new_offset}), 200
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """Verify a finished upload's checksum and turn it into a print job"""
+    data = request.get_json(silent=True) or {}
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    if 'result' in session:
+        # The client didn't get our first answer
+        return jsonify(session['result']), 200
+    if not (data.get('sha256') or session.get('sha256')):
+        return jsonify({'error': 'sha256 is required'}), 400
+
+    try:
+        uploaded = upload_sessions.complete(upload_id, data.get('sha256'))
+    except KeyError:
+        return jsonify({'error': 'Unknown upload'}), 404
+    except UploadConflict as e:
+        return jsonify({'error': 'Upload is incomplete', 'upload_id': upload_id,
+                        'offset': e.offset}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e), 'upload_id': upload_id, 'offset': 0}), 400
+
+    try:
+        file_path = blob_store.add(uploaded)
+        job_id = save_job(session['shop_id'], session['filename'], file_path, uploaded.sha256,
+                          session['copies'], session['color'], session['paper_size'])
+    except Exception as e:
+        uploaded.abort()
+        return jsonify({'error': str(e)}), 500
+
+    result = {'message': 'Print job submitted successfully', 'job_id': job_id}
+    upload_sessions.finish(upload_id, result)
+    return jsonify(result), 200
 
 @app.route('/admin')
 def admin_dashboard():
     """Admin dashboard to view shops and print jobs"""
-    shops = load_shops()
-    return render_template('admin.html', shops=shops)
+    shops = storage.list_shops()
+    # Versioned QR URLs, so browsers keep each image until the shop changes.
+    # Shops whose record can't be encoded fall back to their uploaded image.
+    qr_versions = {}
+    for shop in shops:
+        try:
+            qr_versions[shop['shop_id']] = payload_version(shop_payload(shop))
+        except ValueError:
+            pass
+    return render_template('admin.html', shops=shops, qr_versions=qr_versions)
 
 @app.route('/admin/jobs/<shop_id>')
 def shop_jobs(shop_id):
-    """View print jobs for a specific shop"""
-    jobs_file = os.path.join('data', 'print_jobs', f"{shop_id}_jobs.json")
-    jobs = []
-    
-    if os.path.exists(jobs_file):
-        with open(jobs_file, 'r') as f:
-            try:
-                jobs = json.load(f)
-            except:
-                jobs = []
-    
-    shops = load_shops()
-    shop_name = ""
-    for shop in shops:
-        if shop['shop_id'] == shop_id:
-            shop_name = shop.get('shop_name', shop_id)
-            break
+    """View print jobs for a specific shop (loaded page by page from the API)"""
+    shop = storage.get_shop(shop_id)
+    shop_name = shop.get('shop_name', shop_id) if shop else ""
             
-    return render_template('jobs.html', jobs=jobs, shop_id=shop_id, shop_name=shop_name)
+    return render_template('jobs.html', shop_id=shop_id, shop_name=shop_name)
 
 # Serve QR code images
 @app.route('/static/qr_codes/<path:filename>')
 def serve_qr_code(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    # Uploaded QR files get a new random name each time, so they never change
+    return send_from_directory(UPLOAD_FOLDER, filename, max_age=QR_CACHE_MAX_AGE)
 
 # Create simple HTML templates
 @app.route('/templates/<template_name>')
@@ -223,6 +735,13 @@ def get_template(template_name):
     return send_from_directory('templates', template_name)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Xerox print API server")
+    parser.add_argument('--async', dest='async_mode', action='store_true',
+                        help="serve through the asyncio (ASGI) front end, needs uvicorn")
+    parser.add_argument('--workers', type=int, default=16,
+                        help="thread pool size for the async mode")
+    args = parser.parse_args()
+    
     # Create basic templates if they don't exist
     os.makedirs('templates', exist_ok=True)
     
@@ -301,10 +820,12 @@ if __name__ == '__main__':
                     <td>{{ shop.shop_name or 'N/A' }}</td>
                     <td>{{ shop.server_url }}</td>
                     <td>
-                        {% if shop.qr_code_path %}
+                        {% if shop.shop_id in qr_versions %}
+                        <img src="/api/shops/{{ shop.shop_id }}/qr.png?size=200&v={{ qr_versions[shop.shop_id] }}" class="qr-code">
+                        {% elif shop.qr_code_path %}
                         <img src="/static/qr_codes/{{ shop.qr_code_path }}" class="qr-code">
                         {% else %}
-                        No QR Code
+                        No QR code
                         {% endif %}
                     </td>
                     <td>{{ shop.created_at }}</td>
@@ -329,6 +850,7 @@ if __name__ == '__main__':
     if not os.path.exists('templates/jobs.html'):
         with open('templates/jobs.html', 'w') as f:
             f.write('''
+
 <!DOCTYPE html>
 <html>
 <head>
@@ -342,11 +864,19 @@ if __name__ == '__main__':
         th { background-color: #f2f2f2; }
         tr:hover { background-color: #f5f5f5; }
         .status-pending { color: orange; }
+        .status-printing { color: #3498db; }
         .status-completed { color: green; }
         .status-failed { color: red; }
         .btn { display: inline-block; padding: 8px 16px; background-color: #3498db; color: white; 
                text-decoration: none; border-radius: 4px; }
         .btn:hover { background-color: #2980b9; }
+        .filters { margin-top: 20px; }
+        .filters label { margin-right: 10px; }
+        .filters select, .filters input { padding: 6px; margin-left: 4px; }
+        #load-more { display: none; margin-top: 20px; border: none; cursor: pointer; }
+        button.btn { border: none; cursor: pointer; margin: 2px; }
+        .btn-danger { background-color: #e74c3c; }
+        .bulk-actions { margin-top: 20px; }
     </style>
 </head>
 <body>
@@ -354,10 +884,36 @@ if __name__ == '__main__':
         <h1>Print Jobs for {{ shop_name }}</h1>
         <h3>Shop ID: {{ shop_id }}</h3>
         
-        {% if jobs %}
-        <table>
+        <form id="filters" class="filters">
+            <label>Status:
+                <select name="status">
+                    <option value="">All</option>
+                    <option value="pending">Pending</option>
+                    <option value="printing">Printing</option>
+                    <option value="completed">Completed</option>
+                    <option value="failed">Failed</option>
+                </select>
+            </label>
+            <label>From: <input type="date" name="since"></label>
+            <label>To: <input type="date" name="until"></label>
+            <button type="submit" class="btn">Filter</button>
+        </form>
+        
+        <div class="bulk-actions">
+            <label>Selected jobs:
+                <select id="bulk-status">
+                    <option value="printing">Start Printing</option>
+                    <option value="completed">Mark Completed</option>
+                    <option value="failed">Mark Failed</option>
+                </select>
+            </label>
+            <button id="bulk-apply" class="btn">Apply</button>
+        </div>
+        
+        <table id="jobs-table">
             <thead>
                 <tr>
+                    <th><input type="checkbox" id="select-all"></th>
                     <th>Job ID</th>
                     <th>Filename</th>
                     <th>Copies</th>
@@ -368,40 +924,180 @@ if __name__ == '__main__':
                     <th>Actions</th>
                 </tr>
             </thead>
-            <tbody>
-                {% for job in jobs %}
-                <tr>
-                    <td>{{ job.job_id }}</td>
-                    <td>{{ job.filename }}</td>
-                    <td>{{ job.copies }}</td>
-                    <td>{{ 'Yes' if job.color else 'No' }}</td>
-                    <td>{{ job.paper_size }}</td>
-                    <td class="status-{{ job.status }}">{{ job.status }}</td>
-                    <td>{{ job.created_at }}</td>
-                    <td>
-                        <button class="btn" onclick="updateStatus('{{ job.job_id }}', 'completed')">Mark Completed</button>
-                    </td>
-                </tr>
-                {% endfor %}
-            </tbody>
+            <tbody id="jobs-body"></tbody>
         </table>
-        {% else %}
-        <p>No print jobs for this shop yet.</p>
-        {% endif %}
+        <p id="no-jobs" style="display: none;">No print jobs for this shop yet.</p>
+        <button id="load-more" class="btn">Load More</button>
         
         <p><a href="/admin">Back to Admin Dashboard</a></p>
     </div>
     
     <script>
+        const shopId = {{ shop_id|tojson }};
+        const jobsBody = document.getElementById('jobs-body');
+        const noJobs = document.getElementById('no-jobs');
+        const loadMore = document.getElementById('load-more');
+        const filters = document.getElementById('filters');
+        let nextCursor = null;
+        
+        function escapeHtml(value) {
+            const div = document.createElement('div');
+            div.textContent = value === undefined || value === null ? '' : String(value);
+            return div.innerHTML.replace(/"/g, '&quot;');
+        }
+        
+        function addDays(date, days) {
+            // All in UTC, so the day doesn't shift with the browser's time zone
+            const parts = date.split('-').map(Number);
+            return new Date(Date.UTC(parts[0], parts[1] - 1, parts[2] + days)).toISOString().slice(0, 10);
+        }
+        
+        // Actions offered for each status (pending -> printing -> completed/failed)
+        const ACTIONS = {
+            pending: [['printing', 'Start Printing', 'btn'], ['failed', 'Mark Failed', 'btn btn-danger']],
+            printing: [['completed', 'Mark Completed', 'btn'], ['failed', 'Mark Failed', 'btn btn-danger']]
+        };
+        
+        function jobRowHtml(job) {
+            const actions = (ACTIONS[job.status] || []).map(function(action) {
+                return '<button class="' + action[2] + '" data-status="' + action[0] + '">' + action[1] + '</button>';
+            }).join('');
+            return '<td><input type="checkbox" class="select-job" value="' + escapeHtml(job.job_id) + '"></td>' +
+                '<td>' + escapeHtml(job.job_id) + '</td>' +
+                '<td>' + escapeHtml(job.filename) + '</td>' +
+                '<td>' + escapeHtml(job.copies) + '</td>' +
+                '<td>' + (job.color ? 'Yes' : 'No') + '</td>' +
+                '<td>' + escapeHtml(job.paper_size) + '</td>' +
+                '<td class="status-' + escapeHtml(job.status) + '">' + escapeHtml(job.status) + '</td>' +
+                '<td>' + escapeHtml(job.created_at) + '</td>' +
+                '<td>' + actions + '</td>';
+        }
+        
+        function renderJob(job, prepend) {
+            const row = document.createElement('tr');
+            row.id = 'job-' + job.job_id;
+            row.innerHTML = jobRowHtml(job);
+            if (prepend) {
+                jobsBody.insertBefore(row, jobsBody.firstChild);
+            } else {
+                jobsBody.appendChild(row);
+            }
+        }
+        
+        function refreshJob(job) {
+            const row = document.getElementById('job-' + job.job_id);
+            if (row) row.innerHTML = jobRowHtml(job);
+        }
+        
+        jobsBody.addEventListener('click', function(e) {
+            const status = e.target.getAttribute('data-status');
+            if (status) {
+                updateStatus(e.target.closest('tr').id.slice('job-'.length), status);
+            }
+        });
+        
+        function loadJobs(reset) {
+            const params = new URLSearchParams();
+            const form = new FormData(filters);
+            if (form.get('status')) params.set('status', form.get('status'));
+            if (form.get('since')) params.set('since', form.get('since'));
+            // The "To" date is inclusive, the API's until bound is not
+            if (form.get('until')) params.set('until', addDays(form.get('until'), 1));
+            if (!reset && nextCursor) params.set('cursor', nextCursor);
+            
+            fetch('/api/shops/' + encodeURIComponent(shopId) + '/jobs?' + params.toString())
+                .then(response => response.json())
+                .then(data => {
+                    if (reset) jobsBody.innerHTML = '';
+                    data.jobs.forEach(job => renderJob(job));
+                    nextCursor = data.next_cursor;
+                    loadMore.style.display = nextCursor ? 'inline-block' : 'none';
+                    noJobs.style.display = jobsBody.children.length ? 'none' : 'block';
+                });
+        }
+        
+        filters.addEventListener('submit', function(e) {
+            e.preventDefault();
+            loadJobs(true);
+        });
+        loadMore.addEventListener('click', function() {
+            loadJobs(false);
+        });
+        loadJobs(true);
+        
+        // Live updates: new jobs and status changes are pushed by the server.
+        // EventSource reconnects on its own and resumes from Last-Event-ID.
+        const events = new EventSource('/api/shops/' + encodeURIComponent(shopId) + '/events');
+        events.addEventListener('job_created', function(e) {
+            const job = JSON.parse(e.data);
+            const form = new FormData(filters);
+            const matches = (!form.get('status') || form.get('status') === job.status) && !form.get('until');
+            if (matches && !document.getElementById('job-' + job.job_id)) {
+                renderJob(job, true);
+                noJobs.style.display = 'none';
+            }
+        });
+        events.addEventListener('job_updated', function(e) {
+            refreshJob(JSON.parse(e.data));
+        });
+        events.addEventListener('reset', function() {
+            loadJobs(true);
+        });
+        
         function updateStatus(jobId, status) {
-            // In a real implementation, this would call an API to update the job status
-            alert('This functionality would update job ' + jobId + ' to status: ' + status);
-            // Reload the page to show the updated status
-            // location.reload();
+            fetch('/api/jobs/' + encodeURIComponent(jobId), {
+                method: 'PATCH',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ status: status })
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.job) {
+                    refreshJob(data.job);
+                } else {
+                    alert(data.error || 'Could not update job');
+                }
+            });
         }
+        
+        document.getElementById('select-all').addEventListener('change', function(e) {
+            document.querySelectorAll('.select-job').forEach(function(box) {
+                box.checked = e.target.checked;
+            });
+        });
+        
+        document.getElementById('bulk-apply').addEventListener('click', function() {
+            const jobIds = Array.from(document.querySelectorAll('.select-job:checked')).map(box => box.value);
+            if (!jobIds.length) return;
+            
+            fetch('/api/jobs', {
+                method: 'PATCH',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ job_ids: jobIds, status: document.getElementById('bulk-status').value })
+            })
+            .then(response => response.json())
+            .then(data => {
+                const failed = (data.results || []).filter(result => !result.updated);
+                if (failed.length) {
+                    alert(failed.length + ' job(s) could not be updated: ' + failed[0].error);
+                }
+                loadJobs(true);
+            });
+        });
     </script>
 </body>
 </html>
+            
             ''')
     
-    app.run(debug=True, host='0.0.0.0', port=6989)
+    if args.async_mode:
+        import uvicorn
+        from asgi_server import AsyncPrintServer
+        
+        # Allow some room on top of the file limit for the other form fields
+        asgi_app = AsyncPrintServer(app, event_broker, max_workers=args.workers,
+                                    max_body_size=app.config['MAX_UPLOAD_BYTES'] + 1024 * 1024,
+                                    keepalive=SSE_KEEPALIVE)
+        uvicorn.run(asgi_app, host='0.0.0.0', port=6989)
+    else:
+        app.run(debug=True, host='0.0.0.0', port=6989)
@@ -0,0 +1,137 @@
+import collections
+import json
+import threading
+import time
+
+# Events kept per shop for Last-Event-ID resume
+EVENT_HISTORY = 500
+
+
+class JobEvent:
+    """One published event; its id is '<broker epoch>-<sequence number>'"""
+
+    def __init__(self, event_id, event, data):
+        self.id = event_id
+        self.event = event
+        self.data = data
+
+    def encode(self):
+        """Format the event for a text/event-stream response"""
+        return f"id: {self.id}\nevent: {self.event}\ndata: {json.dumps(self.data)}\n\n"
+
+
+class Subscription:
+    """A subscriber's queue of events for one shop
+
+    Threaded consumers block in get(). Event-loop consumers call set_waker()
+    with a callback that is invoked (from the publishing thread) whenever new
+    events arrive, then drain them with get(timeout=0), so an idle subscriber
+    doesn't need a thread of its own.
+    """
+
+    def __init__(self, channel):
+        self._channel = channel
+        self._events = collections.deque()
+        self._cond = threading.Condition()
+        self._waker = None
+        self.closed = False
+
+    def _push(self, events):
+        with self._cond:
+            self._events.extend(events)
+            self._cond.notify()
+            waker = self._waker
+        if waker is not None:
+            waker()
+
+    def set_waker(self, waker):
+        with self._cond:
+            self._waker = waker
+            pending = bool(self._events)
+        if pending:
+            waker()
+
+    def get(self, timeout=None):
+        """Return the queued events, waiting up to timeout for at least one"""
+        with self._cond:
+            if not self._events and timeout != 0:
+                self._cond.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._channel.unsubscribe(self)
+
+
+class _Channel:
+    def __init__(self, history):
+        self.lock = threading.Lock()
+        self.next_seq = 1
+        self.history = collections.deque(maxlen=history)
+        self.subscribers = set()
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+
+class EventBroker:
+    """In-process pub/sub for per-shop job events
+
+    Each shop has a channel that numbers its events and keeps the last
+    EVENT_HISTORY of them, so a client reconnecting with Last-Event-ID gets
+    what it missed. If that isn't possible (the server restarted, or the client
+    fell too far behind) it gets a single 'reset' event and should reload.
+    """
+
+    def __init__(self, history=EVENT_HISTORY):
+        self.history = history
+        self.epoch = format(int(time.time() * 1000), 'x')
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def _channel(self, shop_id):
+        with self._lock:
+            channel = self._channels.get(shop_id)
+            if channel is None:
+                channel = self._channels[shop_id] = _Channel(self.history)
+            return channel
+
+    def publish(self, shop_id, event, data):
+        channel = self._channel(shop_id)
+        with channel.lock:
+            job_event = JobEvent(f"{self.epoch}-{channel.next_seq}", event, data)
+            channel.next_seq += 1
+            channel.history.append((channel.next_seq - 1, job_event))
+            subscribers = list(channel.subscribers)
+        for subscription in subscribers:
+            subscription._push([job_event])
+
+    def subscribe(self, shop_id, last_event_id=None):
+        """Subscribe to a shop's events, replaying anything after last_event_id"""
+        channel = self._channel(shop_id)
+        subscription = Subscription(channel)
+        with channel.lock:
+            backlog = self._backlog(channel, last_event_id)
+            channel.subscribers.add(subscription)
+        if backlog:
+            subscription._push(backlog)
+        return subscription
+
+    def _backlog(self, channel, last_event_id):
+        if not last_event_id:
+            return []
+
+        epoch, _, seq = last_event_id.partition('-')
+        try:
+            seq = int(seq)
+        except ValueError:
+            seq = None
+
+        oldest = channel.history[0][0] if channel.history else channel.next_seq
+        if epoch != self.epoch or seq is None or seq < oldest - 1:
+            return [JobEvent(f"{self.epoch}-{channel.next_seq - 1}", 'reset', {})]
+        return [job_event for event_seq, job_event in channel.history if event_seq > seq]
@@ -0,0 +1,374 @@
+import bisect
+import json
+import logging
+import os
+import queue
+import threading
+
+from store_writer import DirectWriter, atomic_write_json, fsync_dir
+
+logger = logging.getLogger(__name__)
+
+# Fold the journal into the snapshot once this many records have piled up
+COMPACT_THRESHOLD = 200
+
+
+class JobJournal:
+    """Append-only per-shop job log with background compaction
+
+    Each shop has a <shop_id>.jsonl journal and a <shop_id>.snapshot.json
+    snapshot in the journal directory. Submitting a job appends one "add"
+    record and a status change appends one "update" record, so writes no longer
+    depend on how many jobs a shop has received. A background thread folds the
+    journal into the snapshot once it grows past COMPACT_THRESHOLD records.
+
+    Records are buffered by the writer thread and written out by flush(), so a
+    whole batch of submissions for a shop costs one write and one fsync.
+
+    A shop's journal is replayed into a JobIndex the first time it is read;
+    after that the index is kept up to date as records are flushed. A job_id ->
+    shop_id map sits on top, so a job can be found without knowing its shop.
+    """
+
+    def __init__(self, root, writer=None, compact_threshold=COMPACT_THRESHOLD):
+        self.root = root
+        self.writer = writer or DirectWriter()
+        self.compact_threshold = compact_threshold
+        os.makedirs(root, exist_ok=True)
+
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._pending = {}
+        self._buffers = {}
+        self._indexes = {}
+        self._job_shops = {}
+        self._all_indexed = False
+        self._staged = {}
+        self._compacting = set()
+        self._compact_queue = queue.Queue()
+        self._compactor = None
+
+    def _lock(self, shop_id):
+        with self._locks_guard:
+            lock = self._locks.get(shop_id)
+            if lock is None:
+                lock = self._locks[shop_id] = threading.Lock()
+            return lock
+
+    def journal_path(self, shop_id):
+        return os.path.join(self.root, f"{shop_id}.jsonl")
+
+    def snapshot_path(self, shop_id):
+        return os.path.join(self.root, f"{shop_id}.snapshot.json")
+
+    def _compacting_path(self, shop_id):
+        return self.journal_path(shop_id) + '.compacting'
+
+    def has_shop(self, shop_id):
+        return (os.path.exists(self.snapshot_path(shop_id)) or
+                os.path.exists(self.journal_path(shop_id)))
+
+    def shop_ids(self):
+        """Return the ids of every shop with a snapshot or journal"""
+        shop_ids = set()
+        for name in os.listdir(self.root):
+            for suffix in ('.snapshot.json', '.jsonl'):
+                if name.endswith(suffix):
+                    shop_ids.add(name[:-len(suffix)])
+        return sorted(shop_ids)
+
+    def append(self, shop_id, job):
+        """Record a newly submitted job"""
+        self._write(shop_id, {'op': 'add', 'job': job})
+
+    def append_many(self, jobs):
+        """Record several newly submitted jobs, for any shops, in one commit"""
+        self.writer.execute(lambda: self._stage_adds(jobs), self)
+
+    def _stage_adds(self, jobs):
+        for job in jobs:
+            self._buffers.setdefault(job['shop_id'], []).append({'op': 'add', 'job': job})
+
+    def update(self, shop_id, job_id, fields):
+        """Record a change (e.g. status) to an existing job"""
+        self._write(shop_id, {'op': 'update', 'job_id': job_id, 'fields': fields})
+
+    def update_many(self, changes, check=None):
+        """Apply [(job_id, fields)] changes to jobs in any shop in one commit
+
+        check(job, fields) may return an error message to reject a change; it
+        sees earlier changes from the same commit. Returns a list of
+        (job_id, job, error) with the updated job, or job None if there is no
+        such job.
+        """
+        # Load the job index outside the writer thread so it never waits on it
+        for job_id, _ in changes:
+            self.locate(job_id)
+        return self.writer.execute(lambda: self._stage_updates(changes, check), self)
+
+    def _stage_updates(self, changes, check):
+        results = []
+        for job_id, fields in changes:
+            shop_id = self._job_shops.get(job_id)
+            job = None
+            if shop_id is not None:
+                with self._lock(shop_id):
+                    job = self._index(shop_id).jobs.get(job_id)
+            if job is None:
+                results.append((job_id, None, None))
+                continue
+
+            current = dict(job, **self._staged.get(job_id, {}))
+            error = check(current, fields) if check else None
+            if error:
+                results.append((job_id, current, error))
+                continue
+
+            self._staged.setdefault(job_id, {}).update(fields)
+            self._buffers.setdefault(shop_id, []).append(
+                {'op': 'update', 'job_id': job_id, 'fields': fields})
+            results.append((job_id, dict(current, **fields), None))
+        return results
+
+    def _write(self, shop_id, record):
+        self.writer.execute(lambda: self._buffers.setdefault(shop_id, []).append(record), self)
+
+    def flush(self):
+        """Write out buffered records, one write and fsync per shop"""
+        buffers, self._buffers = self._buffers, {}
+        self._staged = {}
+        for shop_id, records in buffers.items():
+            with self._lock(shop_id):
+                path = self.journal_path(shop_id)
+                is_new = not os.path.exists(path)
+                with open(path, 'a') as f:
+                    f.write(''.join(json.dumps(record) + '\n' for record in records))
+                    f.flush()
+                    os.fsync(f.fileno())
+                if is_new:
+                    fsync_dir(self.root)
+
+                index = self._indexes.get(shop_id)
+                for record in records:
+                    if index is not None:
+                        index.apply(record)
+                    if record['op'] == 'add':
+                        self._job_shops[record['job']['job_id']] = shop_id
+
+                count = self._pending.get(shop_id)
+                if count is None:
+                    count = _count_lines(path)
+                else:
+                    count += len(records)
+                self._pending[shop_id] = count
+
+            if count >= self.compact_threshold and self._compactor is not None:
+                self._compact_queue.put(shop_id)
+
+    def discard(self):
+        """Drop records that failed to flush"""
+        self._buffers = {}
+        self._staged = {}
+
+    def _index(self, shop_id):
+        # Called with the shop's lock held
+        index = self._indexes.get(shop_id)
+        if index is None:
+            jobs = _read_snapshot(self.snapshot_path(shop_id))
+            _replay(jobs, self._compacting_path(shop_id))
+            _replay(jobs, self.journal_path(shop_id))
+            index = self._indexes[shop_id] = JobIndex(jobs.values())
+            for job_id in index.jobs:
+                self._job_shops[job_id] = shop_id
+        return index
+
+    def locate(self, job_id):
+        """Return the id of the shop a job belongs to, or None"""
+        shop_id = self._job_shops.get(job_id)
+        if shop_id is None and not self._all_indexed:
+            # First lookup of a job we haven't seen: index every shop once
+            for other_shop_id in self.shop_ids():
+                with self._lock(other_shop_id):
+                    self._index(other_shop_id)
+            self._all_indexed = True
+            shop_id = self._job_shops.get(job_id)
+        return shop_id
+
+    def jobs(self, shop_id):
+        """Return every job for a shop, oldest first"""
+        with self._lock(shop_id):
+            return list(self._index(shop_id).jobs.values())
+
+    def query(self, shop_id, status=None, since=None, until=None, before=None, limit=50):
+        """Return a page of a shop's jobs, newest first (see JobIndex.query)"""
+        with self._lock(shop_id):
+            return self._index(shop_id).query(status, since, until, before, limit)
+
+    def compact(self, shop_id):
+        """Fold the shop's journal into its snapshot"""
+        with self._locks_guard:
+            if shop_id in self._compacting:
+                return
+            self._compacting.add(shop_id)
+
+        try:
+            journal = self.journal_path(shop_id)
+            compacting = self._compacting_path(shop_id)
+
+            # Rotate the journal so new appends don't wait for the fold. A
+            # leftover .compacting file from a crash is folded as it is.
+            with self._lock(shop_id):
+                if not os.path.exists(compacting):
+                    if not os.path.exists(journal):
+                        return
+                    os.replace(journal, compacting)
+                self._pending[shop_id] = 0
+
+            jobs = _read_snapshot(self.snapshot_path(shop_id))
+            _replay(jobs, compacting)
+
+            with self._lock(shop_id):
+                atomic_write_json(self.snapshot_path(shop_id), list(jobs.values()))
+                os.remove(compacting)
+        finally:
+            with self._locks_guard:
+                self._compacting.discard(shop_id)
+
+    def start_compactor(self):
+        """Start the background compaction thread"""
+        if self._compactor is not None:
+            return
+        self._compactor = threading.Thread(target=self._compact_loop, name='job-journal-compactor',
+                                           daemon=True)
+        self._compactor.start()
+
+    def _compact_loop(self):
+        while True:
+            shop_id = self._compact_queue.get()
+            try:
+                self.compact(shop_id)
+            except Exception:
+                logger.exception("Compaction failed for %s", shop_id)
+
+
+class JobIndex:
+    """One shop's jobs, ordered by (created_at, job_id)
+
+    Alongside the full key list there is one sorted key list per status, so a
+    page of e.g. the newest pending jobs is a couple of bisects plus a slice,
+    whatever the shop's history size.
+    """
+
+    def __init__(self, jobs=()):
+        self.jobs = {}
+        self.keys = []
+        self.by_status = {}
+        for job in jobs:
+            self.add(job)
+
+    def add(self, job):
+        key = (job.get('created_at', ''), job['job_id'])
+        self.jobs[job['job_id']] = job
+        bisect.insort(self.keys, key)
+        bisect.insort(self.by_status.setdefault(job.get('status'), []), key)
+
+    def update(self, job_id, fields):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        old_status = job.get('status')
+        job.update(fields)
+        if job.get('status') != old_status:
+            key = (job.get('created_at', ''), job_id)
+            keys = self.by_status.get(old_status, [])
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+            bisect.insort(self.by_status.setdefault(job.get('status'), []), key)
+
+    def apply(self, record):
+        if record['op'] == 'add':
+            self.add(record['job'])
+        elif record['op'] == 'update':
+            self.update(record['job_id'], record['fields'])
+
+    def query(self, status=None, since=None, until=None, before=None, limit=50):
+        """Return up to limit jobs, newest first
+
+        since is inclusive and until exclusive (ISO timestamps or dates);
+        before is a (created_at, job_id) key to continue a previous page from.
+        """
+        keys = self.by_status.get(status, []) if status else self.keys
+        lo = bisect.bisect_left(keys, (since,)) if since else 0
+        hi = bisect.bisect_left(keys, (until,)) if until else len(keys)
+        if before is not None:
+            hi = min(hi, bisect.bisect_left(keys, tuple(before)))
+        page = keys[max(lo, hi - limit):hi]
+        return [self.jobs[job_id] for _, job_id in reversed(page)]
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, 'r') as f:
+            jobs = json.load(f)
+    except (OSError, ValueError):
+        jobs = []
+    return {job['job_id']: job for job in jobs}
+
+
+def _replay(jobs, path):
+    try:
+        f = open(path, 'r')
+    except OSError:
+        return
+
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn last line from an interrupted write
+                continue
+
+            if record['op'] == 'add':
+                jobs[record['job']['job_id']] = record['job']
+            elif record['op'] == 'update' and record['job_id'] in jobs:
+                jobs[record['job_id']].update(record['fields'])
+
+
+def _count_lines(path):
+    try:
+        with open(path, 'rb') as f:
+            return sum(1 for _ in f)
+    except OSError:
+        return 0
+
+
+def migrate_legacy_jobs(legacy_dir, journal):
+    """Import <shop_id>_jobs.json files into the journal (once per shop)
+
+    The legacy files are left in place; a shop is skipped once it has a
+    snapshot or journal, so running this on every start is cheap.
+    Returns the list of migrated shop ids.
+    """
+    migrated = []
+    if not os.path.isdir(legacy_dir):
+        return migrated
+
+    for name in sorted(os.listdir(legacy_dir)):
+        if not name.endswith('_jobs.json'):
+            continue
+        shop_id = name[:-len('_jobs.json')]
+        if journal.has_shop(shop_id):
+            continue
+
+        try:
+            with open(os.path.join(legacy_dir, name), 'r') as f:
+                jobs = json.load(f)
+        except (OSError, ValueError):
+            continue
+
+        atomic_write_json(journal.snapshot_path(shop_id), jobs)
+        migrated.append(shop_id)
+
+    return migrated
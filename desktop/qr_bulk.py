@@ -0,0 +1,232 @@
+"""Generate (and optionally register) QR codes for many shops without the GUI
+
+    python qr_bulk.py shops.csv --out qr_codes --format png svg --register
+
+The input is a CSV file with shop_id, shop_name and server_url columns, or a
+JSON list of objects with those keys (shops.json works as-is). Rows without
+a shop_id get a generated one and rows without a server_url use --server-url.
+QR codes are rendered across a process pool. With --register, rendered shops
+are sent to their server's /api/register_shops in batches of --batch-size
+(PNG files as binary parts), over a keep-alive session with at most
+--concurrency requests in flight; servers without the bulk endpoint get one
+/api/register_shop request per shop. A summary of what worked and what
+didn't is written to <out>/summary.json.
+"""
+import argparse
+import base64
+import csv
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from qr_payload import build_payload, make_qr, new_shop_id, png_image, svg_image
+
+FORMATS = ('png', 'svg')
+
+
+def read_shops(path):
+    """Load shop rows from a .csv or .json file"""
+    if path.lower().endswith('.json'):
+        with open(path, 'r') as f:
+            shops = json.load(f)
+        if not isinstance(shops, list):
+            raise ValueError(f"{path} must contain a JSON list of shops")
+        return shops
+
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+def render_shop(shop, out_dir, formats, compact=True):
+    """Render one shop's QR code in every format (runs in a worker process)
+
+    Returns the paths written, by format.
+    """
+    qr = make_qr(build_payload(shop['shop_id'], shop['server_url'], shop.get('shop_name'), compact))
+    files = {}
+    for fmt in formats:
+        path = os.path.join(out_dir, f"xerox_shop_{shop['shop_id']}_qr.{fmt}")
+        image = png_image(qr) if fmt == 'png' else svg_image(qr)
+        image.save(path)
+        files[fmt] = path
+    return files
+
+
+def response_error(response):
+    try:
+        error = response.json().get('error', '')
+    except ValueError:
+        error = response.text
+    return f"Server returned error: {response.status_code} - {error}"
+
+
+def register_batch(session, server_url, batch, timeout):
+    """Register [(shop, png_path)] with one print server in one request
+
+    Returns an error message (or None) per shop.
+    """
+    shops = [{'shop_id': shop['shop_id'], 'shop_name': shop.get('shop_name', ''),
+              'server_url': shop['server_url']} for shop, _ in batch]
+    files = {}
+    for index, (shop, png_path) in enumerate(batch):
+        with open(png_path, 'rb') as f:
+            files[f'qr_{index}'] = (os.path.basename(png_path), f.read(), 'image/png')
+
+    response = session.post(f"{server_url.rstrip('/')}/api/register_shops",
+                            data={'shops': json.dumps(shops)}, files=files, timeout=timeout)
+    if response.status_code == 404:
+        # An older server: one shop at a time
+        errors = []
+        for shop, png_path in batch:
+            try:
+                register_shop(session, shop, png_path, timeout)
+            except Exception as e:
+                errors.append(str(e))
+            else:
+                errors.append(None)
+        return errors
+
+    try:
+        results = response.json()['results']
+    except (ValueError, KeyError, TypeError):
+        return [response_error(response)] * len(batch)
+    return [result.get('error') for result in results]
+
+
+def register_shop(session, shop, png_path, timeout):
+    """Register a shop and its QR code through the original per-shop JSON API"""
+    with open(png_path, 'rb') as f:
+        img_str = base64.b64encode(f.read()).decode()
+    data = {
+        "shop_id": shop['shop_id'],
+        "shop_name": shop.get('shop_name', ''),
+        "server_url": shop['server_url'],
+        "qr_code_image": img_str
+    }
+    response = session.post(f"{shop['server_url'].rstrip('/')}/api/register_shop", json=data,
+                            timeout=timeout)
+    if response.status_code != 200:
+        raise RuntimeError(response_error(response))
+
+
+def new_session(concurrency):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate Xerox shop QR codes in bulk")
+    parser.add_argument('input', help="CSV or JSON file of shops")
+    parser.add_argument('--out', default='qr_codes', help="directory for the QR codes")
+    parser.add_argument('--format', nargs='+', choices=FORMATS, default=['png'],
+                        help="image formats to write")
+    parser.add_argument('--json-payload', action='store_true',
+                        help="encode the original JSON payload instead of the compact one")
+    parser.add_argument('--server-url', help="server URL for shops that don't have one")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="rendering processes")
+    parser.add_argument('--register', action='store_true',
+                        help="register each shop with its server")
+    parser.add_argument('--batch-size', type=int, default=50,
+                        help="shops per registration request")
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="most registration requests in flight at once")
+    parser.add_argument('--timeout', type=float, default=10, help="registration timeout in seconds")
+    parser.add_argument('--summary', help="summary file (default: <out>/summary.json)")
+    args = parser.parse_args(argv)
+
+    formats = list(dict.fromkeys(args.format))
+    if args.register and 'png' not in formats:
+        # The server stores the PNG
+        formats.insert(0, 'png')
+
+    shops = []
+    results = []
+    for row in read_shops(args.input):
+        shop = {
+            'shop_id': (row.get('shop_id') or '').strip() or new_shop_id(),
+            'shop_name': (row.get('shop_name') or '').strip(),
+            'server_url': (row.get('server_url') or '').strip() or args.server_url or ''
+        }
+        results.append({'shop_id': shop['shop_id']})
+        shops.append(shop)
+    os.makedirs(args.out, exist_ok=True)
+
+    results_lock = threading.Lock()
+
+    def record(index, **fields):
+        with results_lock:
+            results[index].update(fields)
+
+    def register(server_url, batch):
+        try:
+            errors = register_batch(session, server_url, [(shops[i], png) for i, png in batch],
+                                    args.timeout)
+        except Exception as e:
+            errors = [str(e)] * len(batch)
+        for (index, _), error in zip(batch, errors):
+            if error:
+                record(index, registered=False, error=f"Registration failed: {error}")
+            else:
+                record(index, registered=True)
+
+    session = new_session(args.concurrency) if args.register else None
+    # Rendered shops waiting to be registered, by server
+    pending = {}
+    with ThreadPoolExecutor(max_workers=args.concurrency) as registrar, \
+            ProcessPoolExecutor(max_workers=args.workers) as renderers:
+        futures = {renderers.submit(render_shop, shop, args.out, formats,
+                                     not args.json_payload): index
+                   for index, shop in enumerate(shops)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                files = future.result()
+            except Exception as e:
+                record(index, error=str(e))
+                continue
+            record(index, files=files)
+            print(f"{shops[index]['shop_id']}: {', '.join(files.values())}")
+            if session is not None:
+                server_url = shops[index]['server_url']
+                batch = pending.setdefault(server_url, [])
+                batch.append((index, files['png']))
+                if len(batch) >= args.batch_size:
+                    registrar.submit(register, server_url, pending.pop(server_url))
+
+        for server_url, batch in pending.items():
+            registrar.submit(register, server_url, batch)
+
+    if session is not None:
+        session.close()
+
+    failed = [result for result in results if 'error' in result]
+    summary = {
+        'input': args.input,
+        'finished_at': datetime.now().isoformat(),
+        'total': len(results),
+        'succeeded': len(results) - len(failed),
+        'failed': len(failed),
+        'shops': results
+    }
+    summary_path = args.summary or os.path.join(args.out, 'summary.json')
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    for result in failed:
+        print(f"FAILED {result['shop_id']}: {result['error']}", file=sys.stderr)
+    print(f"{summary['succeeded']} of {summary['total']} shops done, summary in {summary_path}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
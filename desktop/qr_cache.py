@@ -0,0 +1,81 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+from qr_payload import make_qr, png_image, svg_image
+
+QR_FORMATS = ('png', 'svg')
+# Rendered QR codes kept in memory
+QR_CACHE_ENTRIES = 256
+
+
+def payload_version(payload):
+    """Short hash of a QR payload, used to version QR image URLs"""
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class QRCodeCache:
+    """Rendered QR codes, keyed by payload hash, format and size
+
+    The least recently used code is dropped once max_entries are held.
+    Rendering happens outside the lock, so a slow render doesn't hold up
+    hits; two requests missing on the same code may both render it.
+    """
+
+    def __init__(self, max_entries=QR_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def etag(self, payload, fmt, size=None):
+        """Strong ETag of the image get() returns (the same inputs render the same bytes)"""
+        return f"{payload_version(payload)}-{size or 0}.{fmt}"
+
+    def get(self, payload, fmt, size=None):
+        """Return the QR code for payload as PNG or SVG bytes
+
+        size is the PNG's approximate width in pixels (the default is 10
+        pixels per module); SVGs scale, so it is ignored for them.
+        """
+        if fmt == 'svg':
+            size = None
+        key = (payload_version(payload), fmt, size)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+
+        data = render(payload, fmt, size)
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return data
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(len(data) for data in self._entries.values()),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+def render(payload, fmt, size=None):
+    qr = make_qr(payload)
+    if size:
+        qr.box_size = max(size // (qr.modules_count + 2 * qr.border), 1)
+    buffered = io.BytesIO()
+    if fmt == 'png':
+        png_image(qr).save(buffered)
+    else:
+        svg_image(qr).save(buffered)
+    return buffered.getvalue()
@@ -0,0 +1,126 @@
+import json
+import string
+import uuid
+from datetime import datetime
+from urllib.parse import unquote
+
+import qrcode
+from qrcode.image.svg import SvgPathImage
+
+# Compact payloads: X1|<shop_id>|<server_url>|<generated_at>[|<shop_name>],
+# with generated_at as base-36 Unix seconds and '%' and '|' percent-encoded
+# in the fields. Less than half the size of the JSON form, so the symbol is
+# several versions smaller and quicker to render and to scan.
+COMPACT_PREFIX = 'X1|'
+BASE36 = string.digits + string.ascii_lowercase
+
+
+def new_shop_id():
+    """A random shop ID like the ones the generator's "Generate Unique ID" makes"""
+    return f"shop_{uuid.uuid4().hex[:8]}"
+
+
+def _escape(value):
+    return value.replace('%', '%25').replace('|', '%7C')
+
+
+def _base36(number):
+    digits = ''
+    while True:
+        number, digit = divmod(number, 36)
+        digits = BASE36[digit] + digits
+        if not number:
+            return digits
+
+
+def build_payload(shop_id, server_url, shop_name=None, compact=True, generated_at=None):
+    """The text encoded in a shop's QR code, read by the scan page
+
+    compact=False gives the original JSON form, which the scan page still
+    reads. generated_at (a datetime) defaults to now. Raises ValueError if
+    shop_id or server_url is missing.
+    """
+    shop_id = (shop_id or '').strip()
+    server_url = (server_url or '').strip()
+    shop_name = (shop_name or '').strip()
+    if not shop_id:
+        raise ValueError("Shop ID is required")
+    if not server_url or server_url == "https://":
+        raise ValueError("Server URL is required")
+
+    if generated_at is None:
+        generated_at = datetime.now()
+
+    if compact:
+        fields = [shop_id, server_url.rstrip('/'), _base36(int(generated_at.timestamp()))]
+        if shop_name:
+            fields.append(shop_name)
+        return COMPACT_PREFIX + '|'.join(_escape(field) for field in fields)
+
+    qr_data = {
+        "shop_id": shop_id,
+        "server_url": server_url
+    }
+    if shop_name:
+        qr_data["shop_name"] = shop_name
+
+    # Add timestamp for uniqueness
+    qr_data["generated_at"] = generated_at.isoformat()
+    return json.dumps(qr_data)
+
+
+def shop_payload(shop):
+    """The compact payload for a registered shop
+
+    Stamped with when the shop was last registered rather than now, so the
+    same registry entry always gives the same QR code.
+    """
+    changed_at = shop.get('updated_at') or shop.get('created_at')
+    generated_at = datetime.fromisoformat(changed_at) if changed_at else datetime.fromtimestamp(0)
+    return build_payload(shop['shop_id'], shop['server_url'], shop.get('shop_name'),
+                         generated_at=generated_at)
+
+
+def parse_payload(text):
+    """Read either payload form back into a dict like the JSON one
+
+    Raises ValueError if text is neither.
+    """
+    if not text.startswith(COMPACT_PREFIX):
+        qr_data = json.loads(text)
+        if not isinstance(qr_data, dict) or not qr_data.get('shop_id') or not qr_data.get('server_url'):
+            raise ValueError("Invalid QR code format")
+        return qr_data
+
+    fields = [unquote(field) for field in text[len(COMPACT_PREFIX):].split('|')]
+    if len(fields) < 3 or not fields[0] or not fields[1]:
+        raise ValueError("Invalid QR code format")
+    qr_data = {
+        "shop_id": fields[0],
+        "server_url": fields[1],
+        "generated_at": datetime.fromtimestamp(int(fields[2], 36)).isoformat()
+    }
+    if len(fields) > 3 and fields[3]:
+        qr_data["shop_name"] = fields[3]
+    return qr_data
+
+
+def make_qr(payload):
+    """Lay out the QR code for a payload (high error correction, so it survives print wear)"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_H,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr
+
+
+def png_image(qr):
+    return qr.make_image(fill_color="black", back_color="white")
+
+
+def svg_image(qr):
+    return qr.make_image(image_factory=SvgPathImage)
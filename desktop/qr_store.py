@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from store_writer import fsync_dir
+
+logger = logging.getLogger(__name__)
+
+# Files younger than this are never collected: a registration saves its image
+# just before the shop record that references it
+GC_GRACE = 10 * 60
+GC_INTERVAL = 10 * 60
+# Most orphans deleted per second, so a big cleanup doesn't swamp the disk
+GC_RATE = 20
+GC_BATCH = 100
+
+
+class QRImageStore:
+    """Content-addressed store for shop QR code images
+
+    Each image is saved once as qr_<sha256>.png, however many times it is
+    registered. A background collector walks the directory in batches and
+    deletes images no shop references (including older qr_<shop>_<id>.png
+    files) once they are older than the grace period, at most rate per
+    second.
+    """
+
+    def __init__(self, root, referenced, grace=GC_GRACE, interval=GC_INTERVAL, rate=GC_RATE,
+                 batch=GC_BATCH):
+        self.root = root
+        self.referenced = referenced
+        self.grace = grace
+        self.interval = interval
+        self.rate = rate
+        self.batch = batch
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._collector = None
+        self.orphans_found = 0
+        self.orphans_removed = 0
+        self.bytes_reclaimed = 0
+        self.deduplicated = 0
+        self.last_gc = None
+
+    def add(self, data):
+        """Store image bytes, returns the filename to record for the shop"""
+        filename = f"qr_{hashlib.sha256(data).hexdigest()}.png"
+        path = os.path.join(self.root, filename)
+        with self._lock:
+            if os.path.exists(path):
+                # Fresh mtime, so the collector leaves it alone until it is referenced
+                os.utime(path)
+                self.deduplicated += 1
+                return filename
+            tmp_path = os.path.join(self.root, f".{uuid.uuid4().hex}.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        fsync_dir(self.root)
+        return filename
+
+    def collect(self):
+        """Run one pass over the directory, deleting unreferenced images
+
+        Works through the listing GC_BATCH names at a time, re-reading the
+        shops that reference images before each batch. Returns how many
+        files were removed; orphans_found counts every unreferenced file
+        seen, including ones still inside the grace period.
+        """
+        names = sorted(os.listdir(self.root))
+        found = 0
+        removed = 0
+        for start in range(0, len(names), self.batch):
+            if start:
+                time.sleep(1)
+            referenced = self.referenced()
+            cutoff = time.time() - self.grace
+            for name in names[start:start + self.batch]:
+                is_image = name.startswith('qr_') and name.endswith('.png')
+                is_tmp = name.startswith('.') and name.endswith('.tmp')
+                if not (is_image or is_tmp) or name in referenced:
+                    continue
+                found += 1
+                path = os.path.join(self.root, name)
+                with self._lock:
+                    # add() may have just reused it, so the mtime is checked under the lock
+                    try:
+                        st = os.stat(path)
+                        if st.st_mtime > cutoff:
+                            continue
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    removed += 1
+                    self.orphans_removed += 1
+                    self.bytes_reclaimed += st.st_size
+                if self.rate:
+                    time.sleep(1 / self.rate)
+
+        self.orphans_found = found
+        self.last_gc = datetime.now().isoformat()
+        return removed
+
+    def start_collector(self):
+        """Start the background garbage collector"""
+        if self._collector is not None:
+            return
+        self._collector = threading.Thread(target=self._collect_loop, name='qr-gc', daemon=True)
+        self._collector.start()
+
+    def _collect_loop(self):
+        while True:
+            try:
+                self.collect()
+            except Exception:
+                logger.exception("QR image collection failed")
+            time.sleep(self.interval)
+
+    def stats(self):
+        images = 0
+        total = 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.name.startswith('qr_') and entry.name.endswith('.png'):
+                    images += 1
+                    try:
+                        total += entry.stat().st_size
+                    except OSError:
+                        pass
+        return {
+            'images': images,
+            'bytes': total,
+            'deduplicated': self.deduplicated,
+            'orphans_found': self.orphans_found,
+            'orphans_removed': self.orphans_removed,
+            'bytes_reclaimed': self.bytes_reclaimed,
+            'last_gc': self.last_gc
+        }
@@ -0,0 +1,102 @@
+import json
+import os
+import threading
+
+from store_writer import DirectWriter, atomic_write_json
+
+
+class ShopRegistry:
+    """In-memory index of registered shops backed by shops.json
+
+    Shops are held in a dict keyed by shop_id, so lookups don't re-parse the
+    file. The file is only reloaded when its mtime or size changes (e.g. it was
+    edited by hand). Every mutation goes through the writer, which applies it
+    and then calls flush() to write the file back.
+    """
+
+    def __init__(self, path, writer=None):
+        self.path = path
+        self.writer = writer or DirectWriter()
+        self._lock = threading.RLock()
+        self._shops = {}
+        self._snapshot = []
+        self._stamp = None
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _refresh(self):
+        stamp = self._file_stamp()
+        if stamp is not None and stamp == self._stamp:
+            return
+
+        try:
+            with open(self.path, 'r') as f:
+                shops = json.load(f)
+        except (OSError, ValueError):
+            shops = []
+
+        self._shops = {shop['shop_id']: shop for shop in shops}
+        self._snapshot = list(self._shops.values())
+        self._stamp = stamp
+
+    def get(self, shop_id):
+        """Return the shop record for shop_id, or None"""
+        with self._lock:
+            self._refresh()
+            return self._shops.get(shop_id)
+
+    def __contains__(self, shop_id):
+        return self.get(shop_id) is not None
+
+    def snapshot(self):
+        """Return the cached list of shops (treat it as read-only)"""
+        with self._lock:
+            self._refresh()
+            return self._snapshot
+
+    def upsert(self, shop_id, new_shop, updates):
+        """Add new_shop, or apply updates if shop_id is already registered
+
+        Returns True if the shop was newly created.
+        """
+        return self.writer.execute(lambda: self._apply_upsert(shop_id, new_shop, updates), self)
+
+    def upsert_many(self, items):
+        """Apply [(shop_id, new_shop, updates)] with one write of the file
+
+        Returns a list of which shops were newly created.
+        """
+        return self.writer.execute(
+            lambda: [self._apply_upsert(shop_id, new_shop, updates)
+                     for shop_id, new_shop, updates in items], self)
+
+    def _apply_upsert(self, shop_id, new_shop, updates):
+        with self._lock:
+            self._refresh()
+            shop = self._shops.get(shop_id)
+            if shop is None:
+                self._shops[shop_id] = new_shop
+                return True
+            # A new dict, so readers holding the old record or snapshot never
+            # see a half-applied (or later discarded) update
+            self._shops[shop_id] = dict(shop, **updates)
+            return False
+
+    def flush(self):
+        """Write the registry back to disk (called by the writer)"""
+        with self._lock:
+            shops = list(self._shops.values())
+            atomic_write_json(self.path, shops)
+            # Published only once it is on disk
+            self._snapshot = shops
+            self._stamp = self._file_stamp()
+
+    def discard(self):
+        """Drop unsaved changes by forcing a reload from disk"""
+        with self._lock:
+            self._stamp = None
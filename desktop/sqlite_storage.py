@@ -0,0 +1,242 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+
+from job_journal import JobJournal
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shops (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    shop_id TEXT NOT NULL UNIQUE,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    shop_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS jobs_shop_status_created ON jobs (shop_id, status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_shop_created ON jobs (shop_id, created_at);
+"""
+
+# Statements are kept as constants so sqlite3's per-connection statement cache
+# reuses the prepared form instead of re-parsing them on every call
+SELECT_SHOP = 'SELECT data FROM shops WHERE shop_id = ?'
+SELECT_SHOPS = 'SELECT data FROM shops ORDER BY seq'
+INSERT_SHOP = 'INSERT INTO shops (shop_id, data) VALUES (?, ?)'
+INSERT_SHOP_IF_MISSING = 'INSERT OR IGNORE INTO shops (shop_id, data) VALUES (?, ?)'
+UPDATE_SHOP = 'UPDATE shops SET data = ? WHERE shop_id = ?'
+INSERT_JOB = 'INSERT INTO jobs (job_id, shop_id, status, created_at, data) VALUES (?, ?, ?, ?, ?)'
+INSERT_JOB_IF_MISSING = ('INSERT OR IGNORE INTO jobs (job_id, shop_id, status, created_at, data) '
+                         'VALUES (?, ?, ?, ?, ?)')
+SELECT_JOB = 'SELECT data FROM jobs WHERE job_id = ? AND shop_id = ?'
+SELECT_JOB_BY_ID = 'SELECT data FROM jobs WHERE job_id = ?'
+UPDATE_JOB = 'UPDATE jobs SET status = ?, data = ? WHERE job_id = ?'
+SELECT_SHOP_JOBS = 'SELECT data FROM jobs WHERE shop_id = ? ORDER BY created_at, job_id'
+# Pages of jobs, newest first. Missing filters are passed as open-ended bounds
+# so there is one statement per shape instead of one per filter combination.
+QUERY_JOBS = ('SELECT data FROM jobs WHERE shop_id = ? AND created_at >= ? AND created_at < ? '
+              'AND (created_at, job_id) < (?, ?) ORDER BY created_at DESC, job_id DESC LIMIT ?')
+QUERY_JOBS_BY_STATUS = ('SELECT data FROM jobs WHERE shop_id = ? AND status = ? '
+                        'AND created_at >= ? AND created_at < ? AND (created_at, job_id) < (?, ?) '
+                        'ORDER BY created_at DESC, job_id DESC LIMIT ?')
+# Sorts after any ISO timestamp or job id
+MAX_KEY = '\uffff'
+
+
+class SqliteStorage:
+    """Shops and print jobs in a SQLite database (WAL mode)
+
+    Each thread gets its own connection, created on first use and kept for the
+    life of the thread; close() closes all of them.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path, import_from=None):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        is_new = not os.path.exists(path)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+        # A fresh database starts out with whatever the JSON backend had
+        if is_new and import_from:
+            import_json_data(self, import_from)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, cached_statements=256,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def get_shop(self, shop_id):
+        row = self._connect().execute(SELECT_SHOP, (shop_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list_shops(self):
+        return [json.loads(row[0]) for row in self._connect().execute(SELECT_SHOPS)]
+
+    def upsert_shop(self, shop_id, new_shop, updates):
+        return self.upsert_shops([(shop_id, new_shop, updates)])[0]
+
+    def upsert_shops(self, items):
+        """Apply [(shop_id, new_shop, updates)] in one transaction, returns which were created"""
+        created = []
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for shop_id, new_shop, updates in items:
+                row = conn.execute(SELECT_SHOP, (shop_id,)).fetchone()
+                if row is None:
+                    conn.execute(INSERT_SHOP, (shop_id, json.dumps(new_shop)))
+                    created.append(True)
+                    continue
+                shop = json.loads(row[0])
+                shop.update(updates)
+                conn.execute(UPDATE_SHOP, (json.dumps(shop), shop_id))
+                created.append(False)
+        return created
+
+    def add_job(self, job):
+        conn = self._connect()
+        with conn:
+            conn.execute(INSERT_JOB, _job_row(job))
+
+    def add_jobs(self, jobs):
+        """Insert several jobs in one transaction"""
+        conn = self._connect()
+        with conn:
+            conn.executemany(INSERT_JOB, [_job_row(job) for job in jobs])
+
+    def update_job(self, shop_id, job_id, fields):
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(SELECT_JOB, (job_id, shop_id)).fetchone()
+            if row is None:
+                return
+            job = json.loads(row[0])
+            job.update(fields)
+            conn.execute(UPDATE_JOB, (job['status'], json.dumps(job), job_id))
+
+    def update_jobs(self, changes, check=None):
+        """Apply [(job_id, fields)] changes in one transaction (see JobJournal.update_many)"""
+        results = []
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for job_id, fields in changes:
+                row = conn.execute(SELECT_JOB_BY_ID, (job_id,)).fetchone()
+                if row is None:
+                    results.append((job_id, None, None))
+                    continue
+                job = json.loads(row[0])
+                error = check(job, fields) if check else None
+                if error:
+                    results.append((job_id, job, error))
+                    continue
+                job.update(fields)
+                conn.execute(UPDATE_JOB, (job['status'], json.dumps(job), job_id))
+                results.append((job_id, job, None))
+        return results
+
+    def list_jobs(self, shop_id):
+        return [json.loads(row[0]) for row in self._connect().execute(SELECT_SHOP_JOBS, (shop_id,))]
+
+    def query_jobs(self, shop_id, status=None, since=None, until=None, before=None, limit=50):
+        before_created, before_job = before if before is not None else (MAX_KEY, MAX_KEY)
+        bounds = (since or '', until or MAX_KEY, before_created, before_job, limit)
+        if status:
+            rows = self._connect().execute(QUERY_JOBS_BY_STATUS, (shop_id, status) + bounds)
+        else:
+            rows = self._connect().execute(QUERY_JOBS, (shop_id,) + bounds)
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+def _job_row(job):
+    return (job['job_id'], job['shop_id'], job.get('status', 'pending'),
+            job.get('created_at', ''), json.dumps(job))
+
+
+def import_json_data(storage, data_dir):
+    """Copy shops.json and the job journals / *_jobs.json files into storage
+
+    Records already in the database are left alone, so the import can be run
+    again safely. Returns (shops, jobs) counts of rows read.
+    """
+    shops = []
+    try:
+        with open(os.path.join(data_dir, 'shops.json'), 'r') as f:
+            shops = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    # Journals take precedence over the legacy files they were migrated from
+    jobs_by_shop = {}
+    legacy_dir = os.path.join(data_dir, 'print_jobs')
+    if os.path.isdir(legacy_dir):
+        for name in os.listdir(legacy_dir):
+            if not name.endswith('_jobs.json'):
+                continue
+            try:
+                with open(os.path.join(legacy_dir, name), 'r') as f:
+                    jobs_by_shop[name[:-len('_jobs.json')]] = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    journal_dir = os.path.join(data_dir, 'journal')
+    if os.path.isdir(journal_dir):
+        journal = JobJournal(journal_dir)
+        for shop_id in journal.shop_ids():
+            jobs_by_shop[shop_id] = journal.jobs(shop_id)
+
+    conn = storage._connect()
+    job_count = 0
+    with conn:
+        for shop in shops:
+            conn.execute(INSERT_SHOP_IF_MISSING, (shop['shop_id'], json.dumps(shop)))
+        for jobs in jobs_by_shop.values():
+            for job in jobs:
+                conn.execute(INSERT_JOB_IF_MISSING, _job_row(job))
+                job_count += 1
+
+    return len(shops), job_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import JSON shop and job data into SQLite")
+    parser.add_argument('--data-dir', default='data', help="directory holding shops.json")
+    parser.add_argument('--db', default=None, help="database path (default: <data-dir>/xerox.db)")
+    args = parser.parse_args()
+
+    storage = SqliteStorage(args.db or os.path.join(args.data_dir, 'xerox.db'))
+    shops, jobs = import_json_data(storage, args.data_dir)
+    storage.close()
+    print(f"Imported {shops} shops and {jobs} jobs")
+
+
+if __name__ == '__main__':
+    main()
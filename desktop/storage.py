@@ -0,0 +1,71 @@
+import os
+
+from job_journal import JobJournal, migrate_legacy_jobs
+from shop_registry import ShopRegistry
+from store_writer import GroupCommitWriter
+
+BACKENDS = ('json', 'sqlite')
+
+
+class JsonStorage:
+    """Shops in shops.json and print jobs in per-shop journals"""
+
+    name = 'json'
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+
+        # All writes to shops.json and the job journals go through one writer
+        # thread, which batches concurrent requests into a single fsync'd commit
+        self.writer = GroupCommitWriter()
+        self.writer.start()
+
+        self.shops = ShopRegistry(os.path.join(data_dir, 'shops.json'), writer=self.writer)
+
+        # Old <shop_id>_jobs.json files are imported the first time we see them
+        self.journal = JobJournal(os.path.join(data_dir, 'journal'), writer=self.writer)
+        migrate_legacy_jobs(os.path.join(data_dir, 'print_jobs'), self.journal)
+        self.journal.start_compactor()
+
+    def get_shop(self, shop_id):
+        return self.shops.get(shop_id)
+
+    def list_shops(self):
+        return self.shops.snapshot()
+
+    def upsert_shop(self, shop_id, new_shop, updates):
+        return self.shops.upsert(shop_id, new_shop, updates)
+
+    def upsert_shops(self, items):
+        return self.shops.upsert_many(items)
+
+    def add_job(self, job):
+        self.journal.append(job['shop_id'], job)
+
+    def add_jobs(self, jobs):
+        self.journal.append_many(jobs)
+
+    def update_job(self, shop_id, job_id, fields):
+        self.journal.update(shop_id, job_id, fields)
+
+    def update_jobs(self, changes, check=None):
+        return self.journal.update_many(changes, check)
+
+    def list_jobs(self, shop_id):
+        return self.journal.jobs(shop_id)
+
+    def query_jobs(self, shop_id, status=None, since=None, until=None, before=None, limit=50):
+        return self.journal.query(shop_id, status, since, until, before, limit)
+
+    def close(self):
+        pass
+
+
+def open_storage(backend, data_dir='data'):
+    """Open the storage backend named by backend ('json' or 'sqlite')"""
+    if backend == 'json':
+        return JsonStorage(data_dir)
+    if backend == 'sqlite':
+        from sqlite_storage import SqliteStorage
+        return SqliteStorage(os.path.join(data_dir, 'xerox.db'), import_from=data_dir)
+    raise ValueError(f"Unknown storage backend: {backend} (expected one of {', '.join(BACKENDS)})")
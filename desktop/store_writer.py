@@ -0,0 +1,123 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# How long the writer waits for more mutations before committing a batch
+GROUP_COMMIT_WINDOW = 0.005
+MAX_BATCH_SIZE = 256
+
+
+class GroupCommitWriter:
+    """Single writer thread that commits mutations in batches
+
+    Every mutation is a callable applied on the writer thread against a target
+    (the shop registry or the job journal). Mutations arriving within
+    GROUP_COMMIT_WINDOW of each other form one batch: all of them are applied,
+    each dirty target is flushed once (write, fsync), and only then do the
+    callers blocked in execute() get their results back.
+    """
+
+    def __init__(self, window=GROUP_COMMIT_WINDOW, max_batch=MAX_BATCH_SIZE):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='store-writer', daemon=True)
+        self._thread.start()
+
+    def execute(self, fn, target):
+        """Run fn on the writer thread and return its result once durable"""
+        if self._thread is None:
+            self.start()
+        future = Future()
+        self._queue.put((fn, target, future))
+        return future.result()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            _commit(self._next_batch())
+
+
+class DirectWriter:
+    """Writer that applies and flushes each mutation in the calling thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def execute(self, fn, target):
+        future = Future()
+        with self._lock:
+            _commit([(fn, target, future)])
+        return future.result()
+
+
+def _commit(batch):
+    applied = []
+    dirty = []
+    for fn, target, future in batch:
+        try:
+            result = fn()
+        except Exception as e:
+            future.set_exception(e)
+            continue
+        applied.append((future, result))
+        if target not in dirty:
+            dirty.append(target)
+
+    try:
+        for target in dirty:
+            target.flush()
+    except Exception as e:
+        for target in dirty:
+            target.discard()
+        for future, _ in applied:
+            future.set_exception(e)
+        return
+
+    for future, result in applied:
+        future.set_result(result)
+
+
+def fsync_dir(path):
+    """Make a rename inside path durable"""
+    try:
+        fd = os.open(path or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_json(path, data, indent=2):
+    """Write data to path via a temp file, fsync and rename"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(os.path.dirname(path))
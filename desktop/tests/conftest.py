@@ -0,0 +1,34 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+DESKTOP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DESKTOP)
+
+from storage import BACKENDS, open_storage
+
+
+@pytest.fixture(params=BACKENDS)
+def storage(request, tmp_path):
+    """Each storage backend, on an empty data directory"""
+    opened = open_storage(request.param, str(tmp_path))
+    yield opened
+    opened.close()
+
+
+def load_server():
+    """Import a fresh copy of flask-api-server.py, on the data in the current directory"""
+    spec = importlib.util.spec_from_file_location('print_server',
+                                                  os.path.join(DESKTOP, 'flask-api-server.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """A fresh print server module on an empty data directory"""
+    monkeypatch.chdir(tmp_path)
+    return load_server()
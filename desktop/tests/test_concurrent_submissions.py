@@ -0,0 +1,39 @@
+"""Concurrent submissions through the group-commit writer lose nothing"""
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import load_server
+from storage import BACKENDS
+
+SUBMITTERS = 200
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_no_jobs_lost(backend, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('XEROX_STORAGE', backend)
+    server = load_server()
+    response = server.app.test_client().post('/api/register_shop', json={
+        'shop_id': 'alpha', 'server_url': 'http://print.example:6989'})
+    assert response.status_code == 200
+
+    def submit(index):
+        response = server.app.test_client().post('/api/submit-print-job', data={
+            'shop_id': 'alpha',
+            'file': (io.BytesIO(f'%PDF-{index}'.encode()), f'doc_{index}.pdf')
+        }, content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_data()
+        return json.loads(response.get_data())['job_id']
+
+    with ThreadPoolExecutor(max_workers=50) as pool:
+        job_ids = list(pool.map(submit, range(SUBMITTERS)))
+    assert len(set(job_ids)) == SUBMITTERS
+
+    # A restarted server (replaying the journals, or reopening the database) has every job
+    restarted = load_server()
+    stored = restarted.storage.list_jobs('alpha')
+    assert len(stored) == SUBMITTERS
+    assert {job['job_id'] for job in stored} == set(job_ids)
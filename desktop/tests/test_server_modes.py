@@ -0,0 +1,152 @@
+"""The same requests through the WSGI app and the async (ASGI) front end"""
+import asyncio
+import io
+import json
+import os
+from urllib.parse import urlsplit
+
+import pytest
+from werkzeug.datastructures import FileStorage
+from werkzeug.test import encode_multipart
+
+from asgi_server import SPOOL_MEMORY_SIZE, AsyncPrintServer
+
+SHOP = {'shop_id': 'alpha', 'shop_name': 'Alpha', 'server_url': 'http://print.example:6989'}
+
+
+class WsgiClient:
+    def __init__(self, server):
+        self.client = server.app.test_client()
+
+    def request(self, method, path, body=b'', headers=None):
+        response = self.client.open(path, method=method, data=body, headers=headers or {})
+        return response.status_code, response.headers, response.get_data()
+
+    def stream(self, path, headers, until):
+        """Read a streamed response until until appears in it"""
+        response = self.client.get(path, headers=headers, buffered=False)
+        received = b''
+        try:
+            for chunk in response.response:
+                received += chunk if isinstance(chunk, bytes) else chunk.encode()
+                if until in received:
+                    break
+        finally:
+            response.close()
+        return response.status_code, received
+
+
+class AsgiClient:
+    def __init__(self, server):
+        self.app = AsyncPrintServer(server.app, server.event_broker,
+                                    max_body_size=server.app.config['MAX_UPLOAD_BYTES'])
+
+    def request(self, method, path, body=b'', headers=None):
+        status, headers, received = asyncio.run(self._call(method, path, body, headers))
+        return status, headers, received
+
+    def stream(self, path, headers, until):
+        status, _, received = asyncio.run(self._call('GET', path, b'', headers, until))
+        return status, received
+
+    async def _call(self, method, path, body, headers, until=None):
+        url = urlsplit(path)
+        scope = {
+            'type': 'http', 'method': method, 'path': url.path, 'root_path': '',
+            'query_string': url.query.encode(), 'http_version': '1.1', 'scheme': 'http',
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in (headers or {}).items()],
+        }
+        # The body arrives in pieces, as it would from a real client
+        pieces = [body[i:i + 256 * 1024] for i in range(0, len(body), 256 * 1024)] or [b'']
+        messages = [{'type': 'http.request', 'body': piece, 'more_body': i < len(pieces) - 1}
+                    for i, piece in enumerate(pieces)]
+        disconnected = asyncio.Event()
+        response = {'body': b''}
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = {name.decode('latin-1').lower(): value.decode('latin-1')
+                                       for name, value in message['headers']}
+            else:
+                response['body'] += message.get('body', b'')
+                if until is not None and until in response['body']:
+                    disconnected.set()
+
+        await asyncio.wait_for(self.app(scope, receive, send), timeout=10)
+        return response['status'], response['headers'], response['body']
+
+
+@pytest.fixture(params=['wsgi', 'asgi'])
+def client(request, server):
+    client = WsgiClient(server) if request.param == 'wsgi' else AsgiClient(server)
+    status, _, _ = client.request('POST', '/api/register_shop', json.dumps(SHOP).encode(),
+                                  {'Content-Type': 'application/json'})
+    assert status == 200
+    return client
+
+
+def submit(client, shop_id, content, filename='doc.pdf'):
+    boundary, body = encode_multipart({'shop_id': shop_id, 'copies': '2',
+                                       'file': FileStorage(io.BytesIO(content), filename)})
+    return client.request('POST', '/api/submit-print-job', body,
+                          {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+
+@pytest.mark.parametrize('size', [1024, SPOOL_MEMORY_SIZE * 2])
+def test_submit_job(client, size):
+    status, _, body = submit(client, 'alpha', b'%PDF-' + b'x' * size)
+    assert status == 200
+    job_id = json.loads(body)['job_id']
+
+    status, _, body = client.request('GET', '/api/shops/alpha/jobs')
+    assert status == 200
+    jobs = json.loads(body)['jobs']
+    assert [job['job_id'] for job in jobs] == [job_id]
+    assert jobs[0]['copies'] == '2' and jobs[0]['size'] == size + 5
+
+
+def test_submit_to_unknown_shop(client):
+    status, _, body = submit(client, 'nope', b'%PDF-1')
+    assert status == 400
+    assert json.loads(body) == {'error': 'Invalid shop ID'}
+
+
+def test_not_found(client):
+    status, _, body = client.request('GET', '/api/shops/nope')
+    assert status == 404
+    assert json.loads(body) == {'error': 'Unknown shop'}
+
+    status, _, _ = client.request('GET', '/api/no-such-route')
+    assert status == 404
+
+
+def test_events_replay_after_last_event_id(client, server):
+    status, _, body = submit(client, 'alpha', b'%PDF-1')
+    job_id = json.loads(body)['job_id']
+
+    status, received = client.stream('/api/shops/alpha/events',
+                                     {'Last-Event-ID': f'{server.event_broker.epoch}-0'},
+                                     until=b'event: job_created')
+    assert status == 200
+    assert received.startswith(b'retry: 3000\n\n')
+    assert f'"job_id": "{job_id}"'.encode() in received
+
+
+def test_extra_file_parts_are_refused(client, server):
+    boundary, body = encode_multipart({'shop_id': 'alpha',
+                                       'file': FileStorage(io.BytesIO(b'%PDF-1'), 'one.pdf'),
+                                       'other': FileStorage(io.BytesIO(b'%PDF-2'), 'two.pdf')})
+    status, _, body = client.request('POST', '/api/submit-print-job', body,
+                                     {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    assert status == 400
+    assert json.loads(body) == {'error': 'Too many files, the limit is 1'}
+    assert os.listdir(server.blob_store.incoming_dir) == []
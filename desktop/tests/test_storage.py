@@ -0,0 +1,106 @@
+"""Both storage backends must behave the same"""
+
+
+def shop(shop_id, server_url='http://print.example:6989'):
+    return {'shop_id': shop_id, 'shop_name': shop_id.title(), 'server_url': server_url,
+            'created_at': '2025-03-01T09:00:00', 'qr_code_path': None}
+
+
+def job(job_id, shop_id='alpha', created_at='2025-03-01T10:00:00', status='pending'):
+    return {'job_id': job_id, 'shop_id': shop_id, 'filename': f'{job_id}.pdf', 'copies': 1,
+            'color': False, 'paper_size': 'A4', 'status': status, 'created_at': created_at}
+
+
+def test_register_and_list_shops(storage):
+    assert storage.upsert_shop('alpha', shop('alpha'), {}) is True
+    assert storage.upsert_shops([('beta', shop('beta'), {}), ('gamma', shop('gamma'), {})]) == [True, True]
+
+    assert storage.get_shop('alpha')['shop_name'] == 'Alpha'
+    assert storage.get_shop('missing') is None
+    assert sorted(s['shop_id'] for s in storage.list_shops()) == ['alpha', 'beta', 'gamma']
+
+
+def test_reregistering_updates_the_shop(storage):
+    storage.upsert_shop('alpha', shop('alpha'), {})
+    created = storage.upsert_shop('alpha', shop('alpha'), {'server_url': 'http://new.example',
+                                                           'updated_at': '2025-03-02T09:00:00'})
+
+    assert created is False
+    assert storage.get_shop('alpha')['server_url'] == 'http://new.example'
+    assert storage.get_shop('alpha')['created_at'] == '2025-03-01T09:00:00'
+    assert len(storage.list_shops()) == 1
+
+
+def test_submitted_jobs_are_listed(storage):
+    storage.add_job(job('job_1'))
+    storage.add_jobs([job('job_2', created_at='2025-03-01T11:00:00'), job('job_3', shop_id='beta')])
+
+    assert sorted(j['job_id'] for j in storage.list_jobs('alpha')) == ['job_1', 'job_2']
+    assert [j['job_id'] for j in storage.list_jobs('beta')] == ['job_3']
+    assert storage.list_jobs('gamma') == []
+
+
+def test_query_filters_and_pages(storage):
+    storage.add_jobs([
+        job('job_1', created_at='2025-03-01T10:00:00'),
+        job('job_2', created_at='2025-03-02T10:00:00', status='completed'),
+        job('job_3', created_at='2025-03-03T10:00:00'),
+        job('job_4', created_at='2025-03-04T10:00:00', status='completed'),
+        job('job_5', created_at='2025-03-05T10:00:00'),
+    ])
+
+    def ids(jobs):
+        return [j['job_id'] for j in jobs]
+
+    # Newest first
+    assert ids(storage.query_jobs('alpha')) == ['job_5', 'job_4', 'job_3', 'job_2', 'job_1']
+    assert ids(storage.query_jobs('alpha', status='completed')) == ['job_4', 'job_2']
+    # since is inclusive, until exclusive
+    assert ids(storage.query_jobs('alpha', since='2025-03-02', until='2025-03-04')) == ['job_3', 'job_2']
+    assert ids(storage.query_jobs('alpha', status='pending', since='2025-03-02')) == ['job_5', 'job_3']
+
+    first = storage.query_jobs('alpha', limit=2)
+    assert ids(first) == ['job_5', 'job_4']
+    cursor = (first[-1]['created_at'], first[-1]['job_id'])
+    second = storage.query_jobs('alpha', before=cursor, limit=2)
+    assert ids(second) == ['job_3', 'job_2']
+    cursor = (second[-1]['created_at'], second[-1]['job_id'])
+    assert ids(storage.query_jobs('alpha', before=cursor, limit=2)) == ['job_1']
+
+
+def test_update_many(storage):
+    storage.add_jobs([job('job_1'), job('job_2', shop_id='beta'), job('job_3', status='completed')])
+
+    def check(current, fields):
+        if current['status'] == 'completed':
+            return 'already completed'
+        return None
+
+    results = storage.update_jobs([('job_1', {'status': 'printing'}),
+                                   ('job_2', {'status': 'failed'}),
+                                   ('job_3', {'status': 'printing'}),
+                                   ('job_9', {'status': 'printing'})], check)
+
+    by_id = {job_id: (updated, error) for job_id, updated, error in results}
+    assert by_id['job_1'][0]['status'] == 'printing' and by_id['job_1'][1] is None
+    assert by_id['job_2'][0]['status'] == 'failed' and by_id['job_2'][1] is None
+    assert by_id['job_3'][1] == 'already completed'
+    assert by_id['job_9'] == (None, None)
+
+    assert {j['job_id']: j['status'] for j in storage.list_jobs('alpha')} == {
+        'job_1': 'printing', 'job_3': 'completed'}
+    assert storage.query_jobs('beta', status='failed')[0]['job_id'] == 'job_2'
+
+
+def test_update_many_sees_earlier_changes_in_the_batch(storage):
+    storage.add_job(job('job_1'))
+
+    def check(current, fields):
+        if current['status'] == 'printing' and fields['status'] == 'printing':
+            return 'already printing'
+        return None
+
+    results = storage.update_jobs([('job_1', {'status': 'printing'}),
+                                   ('job_1', {'status': 'printing'})], check)
+
+    assert [error for _, _, error in results] == [None, 'already printing']
@@ -0,0 +1,205 @@
+import gzip
+import hashlib
+import os
+import uuid
+import zlib
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 64 * 1024
+MAX_FIELD_SIZE = 64 * 1024
+# Content-Encodings accepted on upload bodies, preferred first
+UPLOAD_ENCODINGS = (('zstd',) if zstandard is not None else ()) + ('gzip',)
+
+
+class UploadTooLarge(Exception):
+    """Raised when an uploaded file goes over the configured size limit"""
+
+
+class UnsupportedEncoding(Exception):
+    """Raised for a request body in a Content-Encoding we can't decode"""
+
+
+class DecodedStream:
+    """Undoes a request body's Content-Encoding as it is read
+
+    Only as much as each read() asks for is decompressed, so size limits
+    downstream apply to the decoded bytes and a small compressed body can't
+    blow up in memory. Corrupt data raises ValueError.
+    """
+
+    def __init__(self, stream, encoding):
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._reader = gzip.GzipFile(fileobj=stream, mode='rb')
+            self._errors = (OSError, EOFError, zlib.error)
+        else:
+            self._reader = zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+            self._errors = (zstandard.ZstdError,)
+
+    def read(self, size=-1):
+        try:
+            return self._reader.read(size)
+        except self._errors as e:
+            raise ValueError(f"Invalid {self.encoding} request body: {e}")
+
+
+def decode_body(stream, content_encoding):
+    """Wrap a request body stream so it reads decoded, per its Content-Encoding"""
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        return stream
+    if encoding not in UPLOAD_ENCODINGS:
+        raise UnsupportedEncoding(f"Unsupported Content-Encoding: {encoding}")
+    return DecodedStream(stream, encoding)
+
+
+class HashingWriter:
+    """Writes an upload to a temp file, hashing and counting bytes as it goes"""
+
+    def __init__(self, directory, max_bytes=None):
+        os.makedirs(directory, exist_ok=True)
+        self.tmp_path = os.path.join(directory, f".upload_{uuid.uuid4().hex}.part")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = open(self.tmp_path, 'wb')
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise UploadTooLarge(f"File is larger than {self.max_bytes} bytes")
+        self._hash.update(data)
+        self._file.write(data)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def commit(self, final_path):
+        """Move the finished file into place under its final name"""
+        self.close()
+        os.replace(self.tmp_path, final_path)
+        self.tmp_path = None
+
+    def abort(self):
+        self._file.close()
+        if self.tmp_path is not None:
+            try:
+                os.remove(self.tmp_path)
+            except OSError:
+                pass
+            self.tmp_path = None
+
+
+class UploadedFile:
+    """A file part that has been streamed to disk but not committed yet"""
+
+    def __init__(self, name, filename, content_type, writer):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.writer = writer
+
+    @property
+    def size(self):
+        return self.writer.size
+
+    @property
+    def sha256(self):
+        return self.writer.sha256
+
+    def commit(self, final_path):
+        self.writer.commit(final_path)
+
+    def abort(self):
+        self.writer.abort()
+
+
+class StreamedUpload:
+    """Form fields and on-disk file parts from a streamed multipart body"""
+
+    def __init__(self):
+        self.fields = {}
+        self.files = []
+
+    def file(self, name):
+        for uploaded in self.files:
+            if uploaded.name == name:
+                return uploaded
+        return None
+
+    def discard(self):
+        """Remove the temp files of any parts that were not committed"""
+        for uploaded in self.files:
+            uploaded.abort()
+
+
+def parse_upload(stream, content_type, directory, max_bytes=None, max_files=None):
+    """Stream a multipart/form-data body straight to disk
+
+    The body is read in CHUNK_SIZE pieces. Each file part is written to a temp
+    file in directory and hashed on the way. UploadTooLarge is raised as soon
+    as a file passes max_bytes. Raises ValueError if the body isn't valid
+    multipart or has more than max_files file parts, which is noticed at the
+    first part too many, before any of it is written.
+    """
+    mimetype, options = parse_options_header(content_type or '')
+    boundary = options.get('boundary')
+    if mimetype != 'multipart/form-data' or not boundary:
+        raise ValueError("Expected a multipart/form-data body")
+
+    # The decoder's buffer limit has to leave room for a whole read chunk
+    decoder = MultipartDecoder(boundary.encode(), max_form_memory_size=MAX_FIELD_SIZE + CHUNK_SIZE)
+    upload = StreamedUpload()
+    part = None
+    value = []
+
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, Field):
+                    part = event
+                    value = []
+                elif isinstance(event, File):
+                    if max_files is not None and len(upload.files) >= max_files:
+                        raise ValueError(f"Too many files, the limit is {max_files}")
+                    part = event
+                    writer = HashingWriter(directory, max_bytes)
+                    upload.files.append(UploadedFile(event.name, event.filename,
+                                                     event.headers.get('Content-Type'), writer))
+                elif isinstance(event, Data):
+                    if isinstance(part, Field):
+                        value.append(event.data)
+                        if sum(len(piece) for piece in value) > MAX_FIELD_SIZE:
+                            raise ValueError(f"Form field {part.name} is too large")
+                        if not event.more_data:
+                            upload.fields.setdefault(part.name, b''.join(value).decode('utf-8', 'replace'))
+                    else:
+                        upload.files[-1].writer.write(event.data)
+                        if not event.more_data:
+                            upload.files[-1].writer.close()
+                event = decoder.next_event()
+
+            if not chunk or isinstance(event, Epilogue):
+                break
+    except Exception:
+        upload.discard()
+        raise
+
+    return upload
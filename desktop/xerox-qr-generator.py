@@ -1,13 +1,14 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-import qrcode
 from PIL import Image, ImageTk
-import json
 import os
+import queue
 import requests
-from datetime import datetime
-import uuid
-import base64
+from concurrent.futures import ThreadPoolExecutor
+from qr_payload import build_payload, make_qr, new_shop_id, png_image
+
+# How often the Tk thread picks up finished network calls
+POLL_INTERVAL_MS = 50
 
 class XeroxQRGenerator:
     def __init__(self, root):
@@ -32,9 +33,20 @@ class XeroxQRGenerator:
         
         # Flask server status (for admin verification)
         self.server_running = False
+        self.checking_url = None
+        
+        # Network calls run on worker threads so the window never freezes;
+        # their results are handed back to the Tk thread through a queue
+        self.session = requests.Session()
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="network")
+        self.results = queue.Queue()
+        self.tasks = {}
         
         self.create_widgets()
-        self.check_server_connection()
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+        self.root.after(POLL_INTERVAL_MS, self.poll_results)
+        # Only once the window is up
+        self.root.after_idle(self.check_server_connection)
         
     def create_widgets(self):
         # Main frame
@@ -112,9 +124,9 @@ class XeroxQRGenerator:
                               command=self.save_qr)
         save_button.pack(side=tk.LEFT, padx=5)
         
-        register_button = ttk.Button(button_frame, text="Register with Server", 
+        self.register_button = ttk.Button(button_frame, text="Register with Server", 
                                   command=self.register_with_server)
-        register_button.pack(side=tk.LEFT, padx=5)
+        self.register_button.pack(side=tk.LEFT, padx=5)
         
         clear_button = ttk.Button(button_frame, text="Clear", 
                                command=self.clear_form)
@@ -137,73 +149,97 @@ class XeroxQRGenerator:
     
     def generate_unique_id(self):
         # Generate a unique shop ID
-        unique_id = f"shop_{uuid.uuid4().hex[:8]}"
+        unique_id = new_shop_id()
         self.shop_id.set(unique_id)
         self.status_bar.config(text=f"Generated unique ID: {unique_id}")
     
+    def run_in_background(self, key, fn, on_done):
+        """Run fn on the network threads and pass (result, error) to on_done on the Tk thread
+
+        Only the latest task for a key reports back: starting another cancels
+        the older one if it hasn't started yet, and drops its result if it has.
+        """
+        self.cancel_task(key)
+        future = self.executor.submit(fn)
+        self.tasks[key] = future
+        future.add_done_callback(lambda f: self.results.put((key, f, on_done)))
+        return future
+    
+    def cancel_task(self, key):
+        future = self.tasks.pop(key, None)
+        if future is not None:
+            future.cancel()
+    
+    def poll_results(self):
+        # Tk may only be touched from its own thread, so results wait here
+        while True:
+            try:
+                key, future, on_done = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if self.tasks.get(key) is not future:
+                continue
+            del self.tasks[key]
+            try:
+                result = future.result()
+            except Exception as e:
+                on_done(None, e)
+            else:
+                on_done(result, None)
+        self.root.after(POLL_INTERVAL_MS, self.poll_results)
+    
+    def close(self):
+        for key in list(self.tasks):
+            self.cancel_task(key)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+        self.root.destroy()
+    
     def check_server_connection(self):
         # Try to connect to the server URL
         url = self.server_url.get()
         if not url or url == "https://":
+            self.cancel_task("health")
             self.server_status_indicator.config(text="No URL provided", foreground="orange")
             return
-            
-        try:
-            self.status_bar.config(text=f"Checking connection to {url}...")
-            response = requests.get(url, timeout=5)
-            if response.status_code == 200:
-                self.server_status_indicator.config(text="Connected", foreground="green")
-                self.server_running = True
-                self.status_bar.config(text=f"Successfully connected to {url}")
-            else:
-                self.server_status_indicator.config(text=f"Error: {response.status_code}", 
-                                                 foreground="red")
-                self.server_running = False
-        except Exception as e:
+        
+        # Already checking this server
+        if "health" in self.tasks and self.checking_url == url:
+            return
+        
+        self.checking_url = url
+        self.server_status_indicator.config(text="Checking...", foreground="gray")
+        self.status_bar.config(text=f"Checking connection to {url}...")
+        self.run_in_background("health", lambda: self.session.get(url, timeout=5).status_code,
+                               lambda status, error: self.show_server_status(url, status, error))
+    
+    def show_server_status(self, url, status, error):
+        if error is not None:
             self.server_status_indicator.config(text="Connection Failed", foreground="red")
             self.server_running = False
-            self.status_bar.config(text=f"Connection error: {str(e)}")
+            self.status_bar.config(text=f"Connection error: {str(error)}")
+        elif status == 200:
+            self.server_status_indicator.config(text="Connected", foreground="green")
+            self.server_running = True
+            self.status_bar.config(text=f"Successfully connected to {url}")
+        else:
+            self.server_status_indicator.config(text=f"Error: {status}", 
+                                             foreground="red")
+            self.server_running = False
     
     def generate_qr(self):
-        # Validate inputs
         shop_id = self.shop_id.get().strip()
-        shop_name = self.shop_name.get().strip()
         server_url = self.server_url.get().strip()
         
-        if not shop_id:
-            messagebox.showerror("Error", "Shop ID is required")
-            return
-            
-        if not server_url or server_url == "https://":
-            messagebox.showerror("Error", "Server URL is required")
+        # Validate inputs and create QR code data (shared with qr_bulk.py)
+        try:
+            payload = build_payload(shop_id, server_url, self.shop_name.get())
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
             return
         
-        # Create QR code data
-        qr_data = {
-            "shop_id": shop_id,
-            "server_url": server_url
-        }
-        
-        if shop_name:
-            qr_data["shop_name"] = shop_name
-            
-        # Add timestamp for uniqueness
-        qr_data["generated_at"] = datetime.now().isoformat()
-        
-        # Convert to JSON string
-        json_data = json.dumps(qr_data)
-        
         # Generate QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_H,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(json_data)
-        qr.make(fit=True)
-        
-        qr_img = qr.make_image(fill_color="black", back_color="white")
+        qr_img = png_image(make_qr(payload))
         
         # Convert to PhotoImage for display
         self.qr_image = qr_img
@@ -250,42 +286,50 @@ class XeroxQRGenerator:
         shop_name = self.shop_name.get().strip()
         server_url = self.server_url.get().strip()
         
-        # Convert QR image to base64 for sending
+        # The QR image goes as a binary file part
         import io
         buffered = io.BytesIO()
         self.qr_image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
         
         # Prepare data for sending
         data = {
             "shop_id": shop_id,
             "shop_name": shop_name,
-            "server_url": server_url,
-            "qr_code_image": img_str
+            "server_url": server_url
         }
+        files = {"qr_code_image": (f"xerox_shop_{shop_id}_qr.png", buffered.getvalue(), "image/png")}
+        
+        self.status_bar.config(text="Registering with server...")
+        self.register_button.config(state=tk.DISABLED)
+        self.run_in_background("register",
+                               lambda: self.session.post(f"{server_url}/api/register_shop",
+                                                         data=data, files=files, timeout=10),
+                               self.show_registration)
+    
+    def show_registration(self, response, error):
+        self.register_button.config(state=tk.NORMAL)
+        if error is not None:
+            self.status_bar.config(text=f"Error registering with server: {str(error)}")
+            messagebox.showerror("Error", f"Failed to register with server: {str(error)}")
+            return
         
-        try:
-            self.status_bar.config(text="Registering with server...")
-            response = requests.post(f"{server_url}/api/register_shop", json=data, timeout=10)
-            
-            if response.status_code == 200:
-                self.status_bar.config(text="Successfully registered with server")
-                messagebox.showinfo("Success", "Shop registered successfully with the server")
-            else:
-                error_msg = f"Server returned error: {response.status_code}"
-                try:
-                    error_msg += f" - {response.json().get('error', '')}"
-                except:
-                    pass
-                    
-                self.status_bar.config(text=error_msg)
-                messagebox.showerror("Error", error_msg)
+        if response.status_code == 200:
+            self.status_bar.config(text="Successfully registered with server")
+            messagebox.showinfo("Success", "Shop registered successfully with the server")
+        else:
+            error_msg = f"Server returned error: {response.status_code}"
+            try:
+                error_msg += f" - {response.json().get('error', '')}"
+            except:
+                pass
                 
-        except Exception as e:
-            self.status_bar.config(text=f"Error registering with server: {str(e)}")
-            messagebox.showerror("Error", f"Failed to register with server: {str(e)}")
+            self.status_bar.config(text=error_msg)
+            messagebox.showerror("Error", error_msg)
     
     def clear_form(self):
+        # A registration still in flight is for the shop being cleared away
+        self.cancel_task("register")
+        self.register_button.config(state=tk.NORMAL)
         self.shop_id.set("")
         self.shop_name.set("")
         self.server_url.set("https://")
@@ -2,15 +2,72 @@
 from flask import Flask, request, jsonify, render_template, send_from_directory
 import requests
 import os
+import sys
 import json
+import hashlib
+import math
+from jinja2 import TemplateNotFound
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.serving import is_running_from_reloader
 from werkzeug.utils import secure_filename
 import uuid
+import time
+import itertools
+
+# Modules shared with the print server
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from server_health import CircuitOpen, ServerHealth
+from server_pool import ServerSessions
+from shop_directory import ShopDirectory, UnknownShop
+from submissions import SubmissionQueue
+from upload_relay import FormRelay, choose_encoding, encode_chunks, multipart_body, multipart_files_body
+from upload_sessions import UploadConflict, UploadSessions, UploadTooLarge
 
 app = Flask(__name__)
 UPLOAD_FOLDER = 'temp_uploads'
+SUBMISSIONS_FOLDER = 'submissions'
+# Resumable uploads from phones in progress
+UPLOAD_SESSIONS_FOLDER = 'uploads'
+MAX_UPLOAD_BYTES = int(os.environ.get('XEROX_MAX_UPLOAD_MB', '64')) * 1024 * 1024
+# Documents bigger than this are sent to the print server in resumable chunks
+RESUMABLE_THRESHOLD = 8 * 1024 * 1024
+FORWARD_CHUNK_SIZE = 4 * 1024 * 1024
+# How much of a spooled document is test-compressed to decide on compression
+COMPRESS_SAMPLE_SIZE = 64 * 1024
+# Most documents one /batch request may carry
+MAX_BATCH_FILES = 20
+# Longest a GET /submissions/<id>?wait= request is held open
+MAX_SUBMISSION_WAIT = 30
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'xlsx', 'pptx', 'jpg', 'jpeg', 'png'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# 'stream' relays uploads to the print server as they arrive; 'spool' saves
+# them first, which lets documents the server already has be skipped
+RELAY_MODE = os.environ.get('XEROX_RELAY_MODE', 'stream')
+
+# Print servers that keep failing are not contacted for a while (circuit
+# breaker), and every known server gets a periodic health check
+server_health = ServerHealth(
+    failure_threshold=int(os.environ.get('XEROX_BREAKER_FAILURES', '5')),
+    reset_timeout=float(os.environ.get('XEROX_BREAKER_RESET', '30')),
+    check_interval=float(os.environ.get('XEROX_HEALTH_INTERVAL', '15'))
+)
+server_health.start()
+
+# Keep-alive connections to each print server
+servers = ServerSessions(
+    pool_size=int(os.environ.get('XEROX_POOL_SIZE', '10')),
+    connect_timeout=float(os.environ.get('XEROX_CONNECT_TIMEOUT', '5')),
+    read_timeout=float(os.environ.get('XEROX_READ_TIMEOUT', '60')),
+    retries=int(os.environ.get('XEROX_RETRIES', '3')),
+    health=server_health
+)
+
+# Each print server's shop list, so uploads for shops it doesn't have are
+# turned away before any of the file is accepted
+shop_directory = ShopDirectory(servers, max_age=float(os.environ.get('XEROX_SHOP_CACHE_SECONDS', '30')))
+
+upload_sessions = UploadSessions(UPLOAD_SESSIONS_FOLDER, MAX_UPLOAD_BYTES)
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs('templates', exist_ok=True)
@@ -18,12 +75,249 @@ os.makedirs('templates', exist_ok=True)
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def file_sha256(filepath):
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def server_has_blob(server_url, sha256):
+    """Ask the print server whether it already stores this document"""
+    try:
+        response = servers.session(server_url).head(f"{server_url}/api/blobs/{sha256}", timeout=5)
+        return response.status_code == 200
+    except requests.RequestException:
+        return False
+
+def job_fields(form):
+    """Map the scan page's form fields onto the print server's"""
+    fields = {}
+    if 'shopId' in form:
+        fields['shop_id'] = form['shopId']
+    if 'copies' in form:
+        fields['copies'] = form['copies']
+    if 'printType' in form:
+        fields['color'] = str(form['printType'] == 'color').lower()
+    if 'paperSize' in form:
+        fields['paper_size'] = form['paperSize']
+    return fields
+
+def check_shop(fields):
+    """Raise UnknownShop if the print server doesn't have the shop (or it moved)"""
+    if fields.get('shopId') and fields.get('serverUrl'):
+        shop_directory.check(fields['serverUrl'], fields['shopId'])
+
+def unknown_shop_response(e):
+    if e.moved_to:
+        return jsonify({'error': str(e), 'serverUrl': e.moved_to, 'status': 'error'}), 409
+    return jsonify({'error': str(e), 'status': 'error'}), 404
+
+def relay_response(response):
+    """Pass the print server's answer back with its own status code"""
+    if response.status_code == 200:
+        result = response.json()
+        return jsonify({
+            'message': 'Print job submitted successfully',
+            'jobId': result.get('job_id', 'Unknown'),
+            'status': 'success'
+        })
+
+    return jsonify({
+        'error': f'Print service error: {response_error(response)}',
+        'status': 'error'
+    }), response.status_code
+
+def response_error(response):
+    """The error message from a print server's reply"""
+    try:
+        return response.json().get('error', response.text)
+    except ValueError:
+        return response.text
+
+def submit_spooled(filepath, filename, form):
+    """Send a document saved under temp_uploads to the print server"""
+    data = job_fields(form)
+    submit_url = f"{form['serverUrl']}/api/submit-print-job"
+    session = servers.session(form['serverUrl'])
+
+    # Skip sending the bytes if the server already has this document
+    response = None
+    sha256 = file_sha256(filepath)
+    if server_has_blob(form['serverUrl'], sha256):
+        blob_data = dict(data, blob_sha256=sha256, filename=filename)
+        # Still multipart (with no file part), as the server expects
+        fields = {name: (None, value) for name, value in blob_data.items()}
+        response = session.post(submit_url, files=fields)
+
+    # Large documents go in resumable chunks, if the server supports them
+    if response is None and os.path.getsize(filepath) > RESUMABLE_THRESHOLD:
+        response = submit_resumable(filepath, filename, form, sha256)
+
+    # Create a multipart form data
+    if response is None or response.status_code == 404:
+        with open(filepath, 'rb') as f:
+            encoding = choose_encoding(f.read(COMPRESS_SAMPLE_SIZE),
+                                       servers.upload_encodings(form['serverUrl']))
+            f.seek(0)
+            boundary = uuid.uuid4().hex
+            body = multipart_body(boundary, data, filename, None,
+                                  iter(lambda: f.read(64 * 1024), b''))
+
+            # Send to the Xerox server
+            response = session.post(
+                submit_url, data=encode_chunks(body, encoding),
+                headers=upload_headers(f'multipart/form-data; boundary={boundary}', encoding))
+    return response
+
+def upload_headers(content_type, encoding):
+    headers = {'Content-Type': content_type}
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return headers
+
+def submit_resumable(filepath, filename, form, sha256):
+    """Send a document through the server's resumable upload API
+
+    A chunk that fails to send is picked up again from the offset the server
+    reports, so a dropped connection costs at most one chunk. Returns the
+    server's finalize response, or None if it has no resumable uploads.
+    """
+    server_url = form['serverUrl']
+    session = servers.session(server_url)
+    size = os.path.getsize(filepath)
+    response = session.post(f"{server_url}/api/uploads",
+                            json=dict(job_fields(form), filename=filename, size=size, sha256=sha256))
+    if response.status_code == 404:
+        return None
+    if response.status_code != 201:
+        return response
+
+    upload_url = f"{server_url}/api/uploads/{response.json()['upload_id']}"
+    offset = 0
+    failures = 0
+    with open(filepath, 'rb') as f:
+        encoding = choose_encoding(f.read(COMPRESS_SAMPLE_SIZE), servers.upload_encodings(server_url))
+        headers = upload_headers('application/octet-stream', encoding)
+        while offset < size:
+            f.seek(offset)
+            chunk = b''.join(encode_chunks([f.read(FORWARD_CHUNK_SIZE)], encoding))
+            try:
+                response = session.put(upload_url, params={'offset': offset}, data=chunk,
+                                       headers=headers)
+            except requests.RequestException:
+                failures += 1
+                if failures > servers.retries:
+                    raise
+                time.sleep(servers.backoff_factor * 2 ** failures)
+                try:
+                    offset = session.get(upload_url).json()['offset']
+                except (requests.RequestException, ValueError, KeyError):
+                    pass
+                continue
+
+            if response.status_code not in (200, 409):
+                return response
+            offset = response.json()['offset']
+            failures = 0
+
+    return session.post(f"{upload_url}/finalize", json={'sha256': sha256})
+
+def spool_path(filename):
+    # Prefixed so two uploads with the same name can't overwrite each other
+    return os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{filename}")
+
+def find_file_part(relay):
+    """Read up to the 'file' part, skipping any other file parts"""
+    part = relay.read_fields()
+    while part is not None and part.name != 'file':
+        for _ in relay.file_chunks():
+            pass
+        part = relay.read_fields()
+    return part
+
+def relay_streaming():
+    """Forward the upload to the print server while it is still arriving
+
+    The print server's request body is generated from ours, chunk by chunk,
+    so the document never touches disk here. If the page sent the file before
+    serverUrl we don't know where to send it yet, and it is spooled to
+    temp_uploads instead.
+    """
+    relay = FormRelay(request.stream, request.content_type)
+    part = find_file_part(relay)
+    if part is None or part.filename == '':
+        return jsonify({'error': 'No file uploaded'}), 400
+    if not allowed_file(part.filename):
+        return jsonify({'error': 'File type not supported'}), 400
+    filename = secure_filename(part.filename)
+
+    server_url = relay.fields.get('serverUrl')
+    if not server_url:
+        filepath = spool_path(filename)
+        try:
+            with open(filepath, 'wb') as f:
+                for chunk in relay.file_chunks():
+                    f.write(chunk)
+            relay.skip_files()
+            if not relay.fields.get('shopId') or not relay.fields.get('serverUrl'):
+                return jsonify({'error': 'Shop ID and Server URL are required'}), 400
+            check_shop(relay.fields)
+            return relay_response(submit_spooled(filepath, filename, relay.fields))
+        finally:
+            os.remove(filepath)
+
+    # Nothing of the file has been read yet
+    check_shop(relay.fields)
+
+    # Compress on the way if the server takes it and the document isn't
+    # already compressed, judging by its first chunk
+    chunks = relay.file_chunks()
+    sample = next(chunks, b'')
+    encoding = choose_encoding(sample, servers.upload_encodings(server_url))
+    sent = job_fields(relay.fields)
+
+    def late_fields():
+        # Fields the page sent after the file
+        relay.skip_files()
+        return {name: value for name, value in job_fields(relay.fields).items() if name not in sent}
+
+    boundary = uuid.uuid4().hex
+    body = multipart_body(boundary, sent, filename, part.headers.get('Content-Type'),
+                          itertools.chain([sample], chunks), late_fields)
+    response = servers.session(server_url).post(
+        f"{server_url}/api/submit-print-job", data=encode_chunks(body, encoding),
+        headers=upload_headers(f'multipart/form-data; boundary={boundary}', encoding))
+    return relay_response(response)
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'GET':
         return render_template('index.html')
 
     if request.method == 'POST':
+        if RELAY_MODE == 'stream':
+            try:
+                return relay_streaming()
+            except RequestEntityTooLarge:
+                return jsonify({'error': 'File is too large', 'status': 'error'}), 413
+            except ValueError as e:
+                return jsonify({'error': str(e), 'status': 'error'}), 400
+            except UnknownShop as e:
+                return unknown_shop_response(e)
+            except CircuitOpen as e:
+                return circuit_open_response(e)
+            except requests.RequestException as e:
+                return jsonify({
+                    'error': f'Could not reach print service: {str(e)}',
+                    'status': 'error'
+                }), 502
+            except Exception as e:
+                return jsonify({
+                    'error': f'Server error: {str(e)}',
+                    'status': 'error'
+                }), 500
+
         if 'file' not in request.files:
             return jsonify({'error': 'No file uploaded'}), 400
 
@@ -35,64 +329,397 @@ def index():
             return jsonify({'error': 'File type not supported'}), 400
 
         try:
-            # Get print options from form
-            copies = request.form.get('copies', '1')
-            paper_size = request.form.get('paperSize', 'A4')
-            orientation = request.form.get('orientation', 'auto')
-            print_type = request.form.get('printType', 'bw')
             shop_id = request.form.get('shopId')
             server_url = request.form.get('serverUrl')
             
             if not shop_id or not server_url:
                 return jsonify({'error': 'Shop ID and Server URL are required'}), 400
+            check_shop(request.form)
 
             # Save file temporarily
             filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            filepath = spool_path(filename)
             file.save(filepath)
 
-            # Prepare data for Xerox API server
-            color = print_type == 'color'
-            
-            # Create a multipart form data
-            with open(filepath, 'rb') as f:
-                files = {'file': (filename, f)}
-                data = {
-                    'shop_id': shop_id,
-                    'copies': copies,
-                    'color': str(color).lower(),
-                    'paper_size': paper_size
-                }
-                
-                # Send to the Xerox server
-                submit_url = f"{server_url}/api/submit-print-job"
-                response = requests.post(submit_url, files=files, data=data)
-
-            # Clean up temp file
-            os.remove(filepath)
+            try:
+                response = submit_spooled(filepath, filename, request.form)
+            finally:
+                # Clean up temp file
+                os.remove(filepath)
 
-            if response.status_code == 200:
-                result = response.json()
-                return jsonify({
-                    'message': 'Print job submitted successfully',
-                    'jobId': result.get('job_id', 'Unknown'),
-                    'status': 'success'
-                })
-            else:
-                return jsonify({
-                    'error': f'Print service error: {response.text}',
-                    'status': 'error'
-                }), 500
+            return relay_response(response)
 
+        except UnknownShop as e:
+            return unknown_shop_response(e)
+        except CircuitOpen as e:
+            return circuit_open_response(e)
+        except requests.RequestException as e:
+            return jsonify({
+                'error': f'Could not reach print service: {str(e)}',
+                'status': 'error'
+            }), 502
         except Exception as e:
             return jsonify({
                 'error': f'Server error: {str(e)}',
                 'status': 'error'
             }), 500
 
+def circuit_open_response(e):
+    response = jsonify({'error': str(e), 'status': 'error'})
+    response.headers['Retry-After'] = str(max(int(e.retry_after), 1))
+    return response, 503
+
+def forward_submission(submission):
+    """Send a queued submission to its print server (runs on a worker thread)"""
+    try:
+        response = submit_spooled(submission['upload_path'], submission['filename'],
+                                  submission['fields'])
+    except CircuitOpen as e:
+        return {'status': 'failed', 'error': str(e), 'http_status': 503}
+    except requests.RequestException as e:
+        return {'status': 'failed', 'error': f'Could not reach print service: {str(e)}',
+                'http_status': 502}
+
+    if response.status_code == 200:
+        return {'status': 'submitted', 'job_id': response.json().get('job_id', 'Unknown')}
+    return {'status': 'failed', 'error': f'Print service error: {response_error(response)}',
+            'http_status': response.status_code}
+
+submissions = SubmissionQueue(SUBMISSIONS_FOLDER, forward_submission,
+                              workers=int(os.environ.get('XEROX_SUBMIT_WORKERS', '4')))
+
+def submission_view(submission):
+    view = {
+        'submissionId': submission['id'],
+        'status': submission['status'],
+        'filename': submission['filename'],
+        'createdAt': submission['created_at'],
+        'updatedAt': submission['updated_at']
+    }
+    if 'job_id' in submission:
+        view['jobId'] = submission['job_id']
+    if 'error' in submission:
+        view['error'] = submission['error']
+    return view
+
+@app.route('/submissions', methods=['POST'])
+def create_submission():
+    """Accept an upload at once and forward it to the print server in the background"""
+    try:
+        relay = FormRelay(request.stream, request.content_type)
+        part = find_file_part(relay)
+        if part is None or part.filename == '':
+            return jsonify({'error': 'No file uploaded', 'status': 'error'}), 400
+        if not allowed_file(part.filename):
+            return jsonify({'error': 'File type not supported', 'status': 'error'}), 400
+        # Don't take a document we already know can't be delivered
+        if relay.fields.get('serverUrl'):
+            server_health.check_available(relay.fields['serverUrl'])
+            check_shop(relay.fields)
+
+        sub_id = submissions.new_id()
+        upload_path = submissions.upload_path(sub_id)
+        try:
+            with open(upload_path, 'wb') as f:
+                for chunk in relay.file_chunks():
+                    f.write(chunk)
+            relay.skip_files()
+            if not relay.fields.get('shopId') or not relay.fields.get('serverUrl'):
+                os.remove(upload_path)
+                return jsonify({'error': 'Shop ID and Server URL are required', 'status': 'error'}), 400
+            submission = submissions.add(sub_id, secure_filename(part.filename), relay.fields)
+        except Exception:
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
+            raise
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'File is too large', 'status': 'error'}), 413
+    except ValueError as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+    except UnknownShop as e:
+        return unknown_shop_response(e)
+    except CircuitOpen as e:
+        return circuit_open_response(e)
+
+    return jsonify(submission_view(submission)), 202
+
+@app.route('/submissions/<sub_id>', methods=['GET'])
+def get_submission(sub_id):
+    """Status of a submission; ?wait=N holds the request until it finishes (up to N seconds)"""
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = None
+    if wait is None or not math.isfinite(wait):
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    wait = min(max(wait, 0), MAX_SUBMISSION_WAIT)
+
+    submission = submissions.get(sub_id, wait)
+    if submission is None:
+        return jsonify({'error': 'Unknown submission'}), 404
+    return jsonify(submission_view(submission))
+
+def read_chunks(filepath):
+    with open(filepath, 'rb') as f:
+        yield from iter(lambda: f.read(64 * 1024), b'')
+
+def submit_batch(spooled, form, options):
+    """Send spooled documents [(filepath, filename, content_type)] to the print server in one request"""
+    server_url = form['serverUrl']
+    # One encoding covers the whole body; worth it if any document compresses
+    encoding = None
+    for filepath, _, _ in spooled:
+        with open(filepath, 'rb') as f:
+            encoding = choose_encoding(f.read(COMPRESS_SAMPLE_SIZE), servers.upload_encodings(server_url))
+        if encoding is not None:
+            break
+
+    fields = dict(job_fields(form), options=json.dumps([job_fields(o) for o in options]))
+    boundary = uuid.uuid4().hex
+    body = multipart_files_body(boundary, fields, [
+        (filename, content_type, read_chunks(filepath))
+        for filepath, filename, content_type in spooled])
+    return servers.session(server_url).post(
+        f"{server_url}/api/submit-print-jobs", data=encode_chunks(body, encoding),
+        headers=upload_headers(f'multipart/form-data; boundary={boundary}', encoding))
+
+@app.route('/batch', methods=['POST'])
+def submit_batch_route():
+    """Send several documents to one shop in a single request
+
+    Takes any number of 'file' parts (up to MAX_BATCH_FILES) with the usual
+    shopId, serverUrl, copies, printType and paperSize fields. An options
+    field, a JSON list with one object per file part, can set copies,
+    printType and paperSize per file. Each file is spooled to disk as it
+    arrives and all of them go to the print server in one request; the answer
+    has a result per file, so files that failed can be sent again on their own.
+    """
+    results = []
+    spooled = []
+    indexes = []
+    try:
+        relay = FormRelay(request.stream, request.content_type)
+        index = 0
+        part = relay.read_fields()
+        while part is not None:
+            if part.name == 'file' and index == 0:
+                check_shop(relay.fields)
+            if part.name != 'file':
+                error = None
+            elif part.filename == '':
+                error = 'No file selected'
+            elif not allowed_file(part.filename):
+                error = 'File type not supported'
+            elif index >= MAX_BATCH_FILES:
+                error = f'At most {MAX_BATCH_FILES} files per batch'
+            else:
+                filename = secure_filename(part.filename)
+                filepath = spool_path(filename)
+                spooled.append((filepath, filename, part.headers.get('Content-Type')))
+                indexes.append(index)
+                with open(filepath, 'wb') as f:
+                    for chunk in relay.file_chunks():
+                        f.write(chunk)
+                index += 1
+                part = relay.read_fields()
+                continue
+
+            for _ in relay.file_chunks():
+                pass
+            if part.name == 'file':
+                results.append({'index': index, 'filename': part.filename, 'error': error})
+                index += 1
+            part = relay.read_fields()
+
+        if not relay.fields.get('shopId') or not relay.fields.get('serverUrl'):
+            return jsonify({'error': 'Shop ID and Server URL are required', 'status': 'error'}), 400
+        try:
+            options = json.loads(relay.fields.get('options') or '[]')
+        except ValueError:
+            options = None
+        if not isinstance(options, list) or not all(isinstance(o, dict) for o in options):
+            return jsonify({'error': 'options must be a JSON list of objects', 'status': 'error'}), 400
+        if not spooled:
+            return jsonify({'error': 'No file uploaded', 'status': 'error', 'results': results}), 400
+
+        response = submit_batch(spooled, relay.fields,
+                                [options[i] if i < len(options) else {} for i in indexes])
+        try:
+            server_results = response.json()['results']
+        except (ValueError, KeyError, TypeError):
+            return jsonify({
+                'error': f'Print service error: {response_error(response)}',
+                'status': 'error'
+            }), response.status_code if response.status_code >= 400 else 502
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'Files are too large', 'status': 'error'}), 413
+    except ValueError as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+    except UnknownShop as e:
+        return unknown_shop_response(e)
+    except CircuitOpen as e:
+        return circuit_open_response(e)
+    except requests.RequestException as e:
+        return jsonify({
+            'error': f'Could not reach print service: {str(e)}',
+            'status': 'error'
+        }), 502
+    finally:
+        for filepath, _, _ in spooled:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+    for result in server_results:
+        view = {'index': indexes[result['index']], 'filename': result['filename']}
+        if 'job_id' in result:
+            view['jobId'] = result['job_id']
+        else:
+            view['error'] = f"Print service error: {result.get('error', 'Unknown error')}"
+        results.append(view)
+    results.sort(key=lambda result: result['index'])
+
+    submitted = sum(1 for result in results if 'jobId' in result)
+    return jsonify({
+        'status': 'success' if submitted == len(results) else 'partial' if submitted else 'error',
+        'submitted': submitted,
+        'failed': len(results) - submitted,
+        'results': results
+    }), 200 if submitted else 400
+
+def upload_view(session):
+    return {'uploadId': session['upload_id'], 'offset': session['offset'], 'size': session['size']}
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Start a resumable upload; the print options are given now, the file in chunks"""
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename', '')
+    if not filename:
+        return jsonify({'error': 'No file selected', 'status': 'error'}), 400
+    if not allowed_file(filename):
+        return jsonify({'error': 'File type not supported', 'status': 'error'}), 400
+    if not data.get('shopId') or not data.get('serverUrl'):
+        return jsonify({'error': 'Shop ID and Server URL are required', 'status': 'error'}), 400
+    try:
+        server_health.check_available(data['serverUrl'])
+        check_shop(data)
+    except UnknownShop as e:
+        return unknown_shop_response(e)
+    except CircuitOpen as e:
+        return circuit_open_response(e)
+
+    form = {name: str(data[name]) for name in ('shopId', 'serverUrl', 'copies', 'paperSize', 'printType')
+            if name in data}
+    try:
+        session = upload_sessions.create(data.get('size'), data.get('sha256'),
+                                         filename=secure_filename(filename), form=form)
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 413
+    except ValueError as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 400
+    return jsonify(upload_view(session)), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """The offset to resume an upload from"""
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({'error': 'Unknown upload', 'status': 'error'}), 404
+    return jsonify(upload_view(session))
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    """Append the request body to an upload at ?offset="""
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'error': 'offset must be an integer', 'status': 'error'}), 400
+
+    try:
+        new_offset = upload_sessions.write(upload_id, offset, request.stream)
+    except KeyError:
+        return jsonify({'error': 'Unknown upload', 'status': 'error'}), 404
+    except UploadConflict as e:
+        return jsonify({'error': str(e), 'uploadId': upload_id, 'offset': e.offset}), 409
+    except (UploadTooLarge, RequestEntityTooLarge) as e:
+        return jsonify({'error': str(e), 'status': 'error'}), 413
+    return jsonify({'uploadId': upload_id, 'offset': new_offset})
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """Check a finished upload and queue it for the print server like POST /submissions"""
+    data = request.get_json(silent=True) or {}
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({'error': 'Unknown upload', 'status': 'error'}), 404
+    if 'result' in session:
+        # Finalized already, the client just didn't get the answer
+        submission = submissions.get(session['result']['submissionId'])
+        return jsonify(submission_view(submission) if submission else session['result']), 202
+
+    try:
+        uploaded = upload_sessions.complete(upload_id, data.get('sha256'))
+    except KeyError:
+        return jsonify({'error': 'Unknown upload', 'status': 'error'}), 404
+    except UploadConflict as e:
+        return jsonify({'error': 'Upload is incomplete', 'uploadId': upload_id, 'offset': e.offset}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e), 'uploadId': upload_id, 'offset': 0}), 400
+
+    sub_id = submissions.new_id()
+    uploaded.commit(submissions.upload_path(sub_id))
+    submission = submissions.add(sub_id, session['filename'], session['form'])
+    upload_sessions.finish(upload_id, {'submissionId': sub_id})
+    return jsonify(submission_view(submission)), 202
+
+@app.route('/shops/<shop_id>', methods=['GET'])
+def get_shop(shop_id):
+    """Check a scanned shop before uploading: ?serverUrl= is the print server from the QR code"""
+    server_url = request.args.get('serverUrl')
+    if not server_url:
+        return jsonify({'error': 'Server URL is required', 'status': 'error'}), 400
+    try:
+        shop = shop_directory.check(server_url, shop_id)
+    except UnknownShop as e:
+        return unknown_shop_response(e)
+    except CircuitOpen as e:
+        return circuit_open_response(e)
+
+    if shop is None:
+        # The print server couldn't be asked; the upload will find out
+        return jsonify({'shopId': shop_id, 'serverUrl': server_url, 'status': 'unverified'})
+    return jsonify({
+        'shopId': shop_id,
+        'shopName': shop.get('shop_name', ''),
+        'serverUrl': shop.get('server_url', server_url),
+        'status': 'ok'
+    })
+
+@app.route('/shop-directory', methods=['GET'])
+def shop_directory_stats():
+    """Shop list cache counters per print server"""
+    return jsonify(shop_directory.stats())
+
+@app.route('/server-health', methods=['GET'])
+def server_health_status():
+    """Circuit breaker state of every print server the relay has used"""
+    return jsonify(server_health.stats())
+
+@app.route('/pool-stats', methods=['GET'])
+def pool_stats():
+    """Connection pool usage per print server, for sizing XEROX_POOL_SIZE"""
+    return jsonify(servers.stats())
+
 @app.route('/scan', methods=['GET'])
 def scan_page():
-    return render_template('scan.html')
+    # The scanner speaks the relay's upload API (compact QR payloads,
+    # /submissions, /batch, resumable /uploads), so there is no stand-in
+    # page to fall back on; it has to ship with the app
+    try:
+        return render_template('scan.html')
+    except TemplateNotFound:
+        return jsonify({'error': 'Scanner page is missing: templates/scan.html was not deployed',
+                        'status': 'error'}), 500
 
 # Add route to serve the HTML template
 @app.route('/templates/<path:path>')
@@ -127,203 +754,11 @@ if not os.path.exists('templates/index.html'):
 </html>
         ''')
 
-if not os.path.exists('templates/scan.html'):
-    with open('templates/scan.html', 'w') as f:
-        f.write('''
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Scan QR Code - Xerox Print</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <script src="https://cdn.jsdelivr.net/npm/jsqr@1.4.0/dist/jsQR.min.js"></script>
-    <style>
-        body { font-family: Arial, sans-serif; margin: 0; padding: 20px; line-height: 1.6; }
-        .container { max-width: 800px; margin: 0 auto; }
-        h1 { color: #2c3e50; }
-        .btn { display: inline-block; padding: 10px 20px; background-color: #3498db; 
-               color: white; text-decoration: none; border-radius: 4px; border: none; cursor: pointer; }
-        .btn:hover { background-color: #2980b9; }
-        #scanner { width: 100%; max-width: 500px; margin: 0 auto; }
-        #video { width: 100%; border: 1px solid #ddd; }
-        #upload-form { display: none; margin-top: 20px; }
-        input, select { padding: 8px; margin-bottom: 10px; width: 100%; }
-        label { display: block; margin-top: 10px; }
-        #success, #error { display: none; padding: 10px; margin-top: 20px; border-radius: 4px; }
-        #success { background-color: #dff0d8; color: #3c763d; border: 1px solid #d6e9c6; }
-        #error { background-color: #f2dede; color: #a94442; border: 1px solid #ebccd1; }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>Scan QR Code</h1>
-        
-        <div id="scanner">
-            <video id="video" autoplay></video>
-            <button id="start-scan" class="btn">Start Scanner</button>
-            <p id="scanning-status">Press the button to start scanning</p>
-        </div>
-        
-        <div id="upload-form">
-            <h2>Upload Document</h2>
-            <p id="shop-info"></p>
-            
-            <form id="print-form">
-                <input type="hidden" id="shop-id" name="shopId">
-                <input type="hidden" id="server-url" name="serverUrl">
-                
-                <label for="file">Select Document:</label>
-                <input type="file" id="file" name="file" required>
-                
-                <label for="copies">Copies:</label>
-                <input type="number" id="copies" name="copies" min="1" value="1">
-                
-                <label for="paperSize">Paper Size:</label>
-                <select id="paperSize" name="paperSize">
-                    <option value="A4">A4</option>
-                    <option value="Letter">Letter</option>
-                    <option value="Legal">Legal</option>
-                </select>
-                
-                <label for="printType">Print Type:</label>
-                <select id="printType" name="printType">
-                    <option value="bw">Black & White</option>
-                    <option value="color">Color</option>
-                </select>
-                
-                <button type="submit" class="btn" style="margin-top: 20px;">Submit Print Job</button>
-            </form>
-        </div>
-        
-        <div id="success"></div>
-        <div id="error"></div>
-        
-        <p><a href="/" class="btn" style="margin-top: 20px;">Back to Home</a></p>
-    </div>
-    
-    <script>
-        document.addEventListener('DOMContentLoaded', function() {
-            const startButton = document.getElementById('start-scan');
-            const video = document.getElementById('video');
-            const scanningStatus = document.getElementById('scanning-status');
-            const uploadForm = document.getElementById('upload-form');
-            const shopInfo = document.getElementById('shop-info');
-            const shopIdInput = document.getElementById('shop-id');
-            const serverUrlInput = document.getElementById('server-url');
-            const printForm = document.getElementById('print-form');
-            const successDiv = document.getElementById('success');
-            const errorDiv = document.getElementById('error');
-            
-            let scanner = null;
-            
-            startButton.addEventListener('click', function() {
-                startScanner();
-            });
-            
-            function startScanner() {
-                // Access the device camera
-                navigator.mediaDevices.getUserMedia({ video: { facingMode: "environment" } })
-                    .then(function(stream) {
-                        video.srcObject = stream;
-                        scanner = setInterval(scanQRCode, 500);
-                        startButton.style.display = 'none';
-                        scanningStatus.textContent = 'Scanning for QR code...';
-                    })
-                    .catch(function(error) {
-                        scanningStatus.textContent = 'Could not access camera: ' + error.message;
-                    });
-            }
-            
-            function scanQRCode() {
-                if (video.readyState === video.HAVE_ENOUGH_DATA) {
-                    // Create a temporary canvas to capture the video frame
-                    const canvas = document.createElement('canvas');
-                    canvas.width = video.videoWidth;
-                    canvas.height = video.videoHeight;
-                    const ctx = canvas.getContext('2d');
-                    ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
-                    
-                    // Get image data for QR code scanning
-                    const imageData = ctx.getImageData(0, 0, canvas.width, canvas.height);
-                    const code = jsQR(imageData.data, imageData.width, imageData.height, {
-                        inversionAttempts: "dontInvert",
-                    });
-                    
-                    if (code) {
-                        // Stop scanning
-                        clearInterval(scanner);
-                        video.srcObject.getTracks().forEach(track => track.stop());
-                        
-                        // Parse QR code data
-                        try {
-                            const qrData = JSON.parse(code.data);
-                            if (qrData.shop_id && qrData.server_url) {
-                                scanningStatus.textContent = 'QR code detected!';
-                                shopInfo.textContent = 'Printing at: ' + (qrData.shop_name || qrData.shop_id);
-                                shopIdInput.value = qrData.shop_id;
-                                serverUrlInput.value = qrData.server_url;
-                                
-                                // Hide scanner, show upload form
-                                document.getElementById('scanner').style.display = 'none';
-                                uploadForm.style.display = 'block';
-                            } else {
-                                scanningStatus.textContent = 'Invalid QR code format';
-                                startButton.style.display = 'inline-block';
-                            }
-                        } catch (e) {
-                            scanningStatus.textContent = 'Could not parse QR code data';
-                            startButton.style.display = 'inline-block';
-                        }
-                    }
-                }
-            }
-            
-            // Handle form submission
-            printForm.addEventListener('submit', function(e) {
-                e.preventDefault();
-                
-                const formData = new FormData(printForm);
-                
-                // Show loading state
-                const submitBtn = printForm.querySelector('button[type="submit"]');
-                const originalBtnText = submitBtn.textContent;
-                submitBtn.textContent = 'Submitting...';
-                submitBtn.disabled = true;
-                
-                // Clear previous messages
-                successDiv.style.display = 'none';
-                errorDiv.style.display = 'none';
-                
-                fetch('/', {
-                    method: 'POST',
-                    body: formData
-                })
-                .then(response => response.json())
-                .then(data => {
-                    submitBtn.textContent = originalBtnText;
-                    submitBtn.disabled = false;
-                    
-                    if (data.status === 'success') {
-                        successDiv.textContent = data.message + ' Job ID: ' + data.jobId;
-                        successDiv.style.display = 'block';
-                        printForm.reset();
-                    } else {
-                        errorDiv.textContent = data.error || 'An error occurred';
-                        errorDiv.style.display = 'block';
-                    }
-                })
-                .catch(error => {
-                    submitBtn.textContent = originalBtnText;
-                    submitBtn.disabled = false;
-                    
-                    errorDiv.textContent = 'Network error: ' + error.message;
-                    errorDiv.style.display = 'block';
-                });
-            });
-        });
-    </script>
-</body>
-</html>
-        ''')
+# Forward the submissions left over from the last run, whatever server runs
+# the app. The debug reloader's watcher process (this file run directly,
+# not from the reloader) never serves, so it leaves them to its child.
+if __name__ != '__main__' or is_running_from_reloader():
+    submissions.recover()
 
 if __name__ == '__main__':
     app.run(debug=True, port=8988)
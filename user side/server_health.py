@@ -0,0 +1,172 @@
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from server_pool import SERVER_FAILURE_CODES, server_key
+
+# Servers nobody has sent anything to for this long are no longer checked
+FORGET_AFTER = 60 * 60
+
+
+class CircuitOpen(requests.ConnectionError):
+    """Raised instead of contacting a print server that is known to be down"""
+
+    def __init__(self, server, retry_after):
+        super().__init__(f"Print server {server} is not responding, "
+                         f"try again in {max(int(retry_after), 1)}s")
+        self.server = server
+        self.retry_after = retry_after
+
+
+class Circuit:
+    """Circuit breaker for one print server
+
+    Closed: requests go through. After failure_threshold failures in a row
+    it opens and requests fail at once with CircuitOpen. Once reset_timeout
+    has passed it is half-open: one request (or health check) is let through
+    as a probe, and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, server, failure_threshold=5, reset_timeout=30):
+        self.server = server
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+        self.last_success = None
+        self.last_failure = None
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        """Seconds until the circuit lets a request through, 0 if it would now"""
+        with self._lock:
+            return self._retry_after(time.monotonic())
+
+    def _retry_after(self, now):
+        if self.state == 'closed':
+            return 0
+        if self.state == 'open':
+            return max(self.opened_at + self.reset_timeout - now, 0)
+        # Half-open: only one probe at a time, unless it never reported back
+        if self.probe_started is None:
+            return 0
+        return max(self.probe_started + self.reset_timeout - now, 0)
+
+    def before_request(self):
+        """Raise CircuitOpen unless a request may go to the server now"""
+        now = time.monotonic()
+        with self._lock:
+            self.last_used = now
+            retry_after = self._retry_after(now)
+            if retry_after > 0:
+                raise CircuitOpen(self.server, retry_after)
+            if self.state != 'closed':
+                self.state = 'half_open'
+                self.probe_started = now
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started = None
+            self.last_success = datetime.now().isoformat()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.last_failure = datetime.now().isoformat()
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.probe_started = None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'retry_after': round(self._retry_after(time.monotonic()), 1),
+                'last_success': self.last_success,
+                'last_failure': self.last_failure
+            }
+
+
+class ServerHealth:
+    """Circuit breakers for every print server, plus background health checks
+
+    A background thread GETs each server's / route every check_interval
+    seconds. A failed check counts against the circuit like a failed request;
+    a successful one closes it, so a server that comes back is used again
+    without a user request having to be the probe.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, check_interval=15, check_timeout=3):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self._circuits = {}
+        self._lock = threading.Lock()
+        self._checker = None
+        # Health checks get their own connections and are never retried
+        self._session = requests.Session()
+
+    def circuit(self, server_url):
+        key = server_key(server_url)
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:
+                circuit = self._circuits[key] = Circuit(key, self.failure_threshold,
+                                                        self.reset_timeout)
+            return circuit
+
+    def check_available(self, server_url):
+        """Raise CircuitOpen if requests to server_url would fail fast right now"""
+        circuit = self.circuit(server_url)
+        retry_after = circuit.retry_after()
+        if retry_after > 0:
+            raise CircuitOpen(circuit.server, retry_after)
+
+    def check(self, circuit):
+        """Run one health check against a server"""
+        try:
+            response = self._session.get(f"{circuit.server}/", timeout=self.check_timeout)
+        except requests.RequestException:
+            circuit.record_failure()
+            return False
+        if response.status_code in SERVER_FAILURE_CODES:
+            circuit.record_failure()
+            return False
+        circuit.record_success()
+        return True
+
+    def start(self):
+        """Start the background health check thread"""
+        if self._checker is not None:
+            return
+        self._checker = threading.Thread(target=self._check_loop, name='server-health',
+                                         daemon=True)
+        self._checker.start()
+
+    def _check_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            cutoff = time.monotonic() - FORGET_AFTER
+            with self._lock:
+                circuits = list(self._circuits.values())
+            for circuit in circuits:
+                if circuit.last_used < cutoff and circuit.state == 'closed':
+                    continue
+                self.check(circuit)
+
+    def stats(self):
+        """Return each server's circuit state"""
+        with self._lock:
+            circuits = dict(self._circuits)
+        return {key: circuit.snapshot() for key, circuit in circuits.items()}
@@ -0,0 +1,142 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Answers that mean the server itself is in trouble
+SERVER_FAILURE_CODES = (502, 503, 504)
+
+
+def server_key(server_url):
+    """Identify a print server by scheme://host:port"""
+    parts = urlsplit(server_url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class ServerAdapter(HTTPAdapter):
+    """HTTPAdapter with a default timeout that counts requests in flight
+
+    With a circuit (see server_health.Circuit) every request is checked
+    against it first and its outcome recorded; a request to a server whose
+    circuit is open fails at once with CircuitOpen.
+    """
+
+    def __init__(self, timeout, circuit=None, **kwargs):
+        self.timeout = timeout
+        self.circuit = circuit
+        self.in_flight = 0
+        # Request Content-Encodings the server has said it accepts
+        self.upload_encodings = ()
+        self._lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if self.circuit is not None:
+            self.circuit.before_request()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            response = super().send(request, timeout=timeout or self.timeout, **kwargs)
+        except requests.RequestException:
+            if self.circuit is not None:
+                self.circuit.record_failure()
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+        if 'Accept-Encoding' in response.headers:
+            self.upload_encodings = tuple(
+                encoding.strip().lower() for encoding in response.headers['Accept-Encoding'].split(',')
+                if encoding.strip())
+        if self.circuit is not None:
+            if response.status_code in SERVER_FAILURE_CODES:
+                self.circuit.record_failure()
+            else:
+                self.circuit.record_success()
+        return response
+
+    def stats(self):
+        idle = new = requests_sent = 0
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+            new += pool.num_connections
+            requests_sent += pool.num_requests
+        return {
+            'in_use': self.in_flight,
+            'idle': idle,
+            'new_connections': new,
+            'reused_connections': max(requests_sent - new, 0),
+        }
+
+
+class ServerSessions:
+    """One keep-alive requests.Session per print server
+
+    Sessions are keyed by the server's scheme://host:port, so every submission
+    to a shop server reuses the same pool of up to pool_size connections
+    instead of connecting (and for https, handshaking) each time. Requests
+    without an explicit timeout get (connect_timeout, read_timeout).
+
+    Failed connections are retried up to retries times with exponential
+    backoff, as no request was sent. Other failures (including 502/503/504
+    answers) are retried only for GET and HEAD; a POST that reached the server
+    is never sent twice.
+
+    With a ServerHealth, each server's requests go through its circuit breaker.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=5, read_timeout=60, retries=3,
+                 backoff_factor=0.5, health=None):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.health = health
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, server_url):
+        key = server_key(server_url)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = self._new_session(key)
+            return session
+
+    def _new_session(self, key):
+        retry = Retry(total=self.retries, connect=self.retries, read=self.retries,
+                      status=self.retries, backoff_factor=self.backoff_factor,
+                      allowed_methods=frozenset({'GET', 'HEAD'}),
+                      status_forcelist=SERVER_FAILURE_CODES, raise_on_status=False)
+        circuit = self.health.circuit(key) if self.health is not None else None
+        adapter = ServerAdapter(self.timeout, circuit, pool_connections=1,
+                                pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def upload_encodings(self, server_url):
+        """Content-Encodings the server accepts on uploads, as far as we know yet"""
+        return self.session(server_url).get_adapter(server_key(server_url)).upload_encodings
+
+    def stats(self):
+        """Return connection pool statistics for each server"""
+        with self._lock:
+            sessions = dict(self._sessions)
+        return {key: dict(session.get_adapter(key).stats(), pool_size=self.pool_size)
+                for key, session in sessions.items()}
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
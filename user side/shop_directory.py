@@ -0,0 +1,195 @@
+import threading
+import time
+from urllib.parse import quote
+
+import requests
+
+from server_health import CircuitOpen
+from server_pool import server_key
+
+# How long a cached shop list is trusted before it is revalidated
+MAX_AGE = 30
+# Deltas can't report removed shops, so the whole list is fetched this often
+FULL_REFRESH_INTERVAL = 10 * 60
+# How long a shop the server said it doesn't have is remembered
+MISSING_TTL = 30
+# Directory requests are a pre-check, so they don't get the upload's long read timeout
+FETCH_TIMEOUT = 5
+
+
+class UnknownShop(Exception):
+    """The print server has no such shop, or lists it under another server"""
+
+    def __init__(self, shop_id, moved_to=None):
+        if moved_to:
+            message = f"Shop {shop_id} has moved to {moved_to}"
+        else:
+            message = f"Unknown shop {shop_id}"
+        super().__init__(message)
+        self.shop_id = shop_id
+        self.moved_to = moved_to
+
+
+class ServerShops:
+    """What we know about one print server's shops"""
+
+    def __init__(self, server):
+        self.server = server
+        self.shops = {}
+        self.missing = {}
+        self.etag = None
+        self.changed_since = None
+        self.synced_at = None
+        self.full_synced_at = None
+        # A thread is fetching the shop list; others use what is cached meanwhile
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+
+class ShopDirectory:
+    """Cached copy of each print server's shop list
+
+    A server's list is revalidated at most every max_age seconds with a
+    conditional GET /api/shops: If-None-Match gets a bodyless 304 when nothing
+    changed, and changed_since limits a 200 to the shops that did. A shop
+    missing from the cache is looked up on its own before it is rejected, so a
+    shop registered a moment ago isn't turned away.
+
+    Lookups fail open: if a server can't be asked (other than its circuit
+    being open), the upload goes ahead and the server has the final say.
+    """
+
+    def __init__(self, sessions, max_age=MAX_AGE, full_refresh_interval=FULL_REFRESH_INTERVAL):
+        self.sessions = sessions
+        self.max_age = max_age
+        self.full_refresh_interval = full_refresh_interval
+        self._servers = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.not_modified = 0
+        self.refreshes = 0
+
+    def _server(self, server_url):
+        key = server_key(server_url)
+        with self._lock:
+            entry = self._servers.get(key)
+            if entry is None:
+                entry = self._servers[key] = ServerShops(key)
+            return entry
+
+    def check(self, server_url, shop_id):
+        """Raise UnknownShop unless server_url has shop_id registered to itself
+
+        Returns the shop's record, or None if the server couldn't be asked.
+        """
+        shop = self.lookup(server_url, shop_id)
+        if shop is False:
+            raise UnknownShop(shop_id)
+        if shop is not None and shop.get('server_url') and \
+                server_key(shop['server_url']) != server_key(server_url):
+            raise UnknownShop(shop_id, shop['server_url'])
+        return shop
+
+    def lookup(self, server_url, shop_id):
+        """Return the shop's record, False if the server doesn't have it, None if we can't tell"""
+        entry = self._server(server_url)
+        try:
+            self._revalidate(entry)
+            with entry.lock:
+                shop = entry.shops.get(shop_id)
+                if shop is not None:
+                    return shop
+                if time.monotonic() - entry.missing.get(shop_id, -MISSING_TTL) < MISSING_TTL:
+                    return False
+            return self._fetch_shop(entry, shop_id)
+        except CircuitOpen:
+            raise
+        except (requests.RequestException, ValueError):
+            return None
+
+    def _revalidate(self, entry):
+        """Refresh the server's shop list if it is older than max_age
+
+        entry.lock is only held to read and update the cache, never across the
+        request, and one thread refreshes at a time, so a slow server doesn't
+        hold up other checks against it.
+        """
+        with entry.lock:
+            now = time.monotonic()
+            if entry.synced_at is not None and now - entry.synced_at <= self.max_age:
+                self.hits += 1
+                return
+            if entry.refreshing:
+                return
+            entry.refreshing = True
+            full = (entry.full_synced_at is None or
+                    now - entry.full_synced_at > self.full_refresh_interval)
+            params = {}
+            headers = {}
+            if not full and entry.changed_since:
+                params['changed_since'] = entry.changed_since
+            # The ETag covers the server's whole list, so a 304 is good for either
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+
+        try:
+            session = self.sessions.session(entry.server)
+            response = session.get(f"{entry.server}/api/shops", params=params, headers=headers,
+                                   timeout=FETCH_TIMEOUT)
+            self.refreshes += 1
+            shops = None
+            if response.status_code == 304:
+                self.not_modified += 1
+            else:
+                response.raise_for_status()
+                shops = response.json()
+        except Exception:
+            with entry.lock:
+                entry.refreshing = False
+            raise
+
+        with entry.lock:
+            entry.refreshing = False
+            if shops is not None:
+                self._apply(entry, shops, full, response.headers.get('ETag'))
+            entry.synced_at = now
+            if full:
+                entry.full_synced_at = now
+
+    def _apply(self, entry, shops, full, etag):
+        # Called with entry.lock held
+        if full:
+            entry.shops = {shop['shop_id']: shop for shop in shops}
+        else:
+            entry.shops = dict(entry.shops, **{shop['shop_id']: shop for shop in shops})
+        for shop in shops:
+            entry.missing.pop(shop['shop_id'], None)
+            changed_at = max(shop.get('updated_at') or '', shop.get('created_at') or '')
+            if changed_at > (entry.changed_since or ''):
+                entry.changed_since = changed_at
+        entry.etag = etag
+
+    def _fetch_shop(self, entry, shop_id):
+        session = self.sessions.session(entry.server)
+        response = session.get(f"{entry.server}/api/shops/{quote(shop_id, safe='')}",
+                               timeout=FETCH_TIMEOUT)
+        with entry.lock:
+            if response.status_code == 404:
+                entry.missing[shop_id] = time.monotonic()
+                return False
+            response.raise_for_status()
+            shop = response.json()
+            entry.shops = dict(entry.shops, **{shop_id: shop})
+        return shop
+
+    def stats(self):
+        """Return cache counters and how many shops are cached per server"""
+        with self._lock:
+            servers = dict(self._servers)
+        return {
+            'hits': self.hits,
+            'refreshes': self.refreshes,
+            'not_modified': self.not_modified,
+            'servers': {key: {'shops': len(entry.shops), 'etag': entry.etag}
+                        for key, entry in servers.items()}
+        }
@@ -0,0 +1,162 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Finished submissions are kept this long for status lookups
+KEEP_FINISHED_SECONDS = 24 * 60 * 60
+SUBMISSION_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+PENDING = ('queued', 'forwarding')
+
+
+class SubmissionQueue:
+    """Uploads accepted from phones, forwarded to print servers in the background
+
+    Each submission is a <id>.upload file holding the document and a <id>.json
+    state file in root, both fsync'd before the phone gets its submission id.
+    A bounded pool of worker threads calls forward(submission) for each one,
+    which returns the fields to record (status 'submitted' or 'failed', plus
+    job_id or error). The upload is deleted once it has been forwarded.
+
+    On start, submissions still 'queued' or 'forwarding' are queued again, so
+    a restart loses nothing. One that was being forwarded when the relay died
+    is sent again, which can print it twice if the server had already taken it.
+    """
+
+    def __init__(self, root, forward, workers=4):
+        self.root = root
+        self.forward = forward
+        os.makedirs(root, exist_ok=True)
+        self._cond = threading.Condition()
+        self._last_prune = 0
+        self._recovered = False
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='submission')
+
+    def new_id(self):
+        return uuid.uuid4().hex
+
+    def upload_path(self, sub_id):
+        return os.path.join(self.root, f"{sub_id}.upload")
+
+    def _state_path(self, sub_id):
+        return os.path.join(self.root, f"{sub_id}.json")
+
+    def add(self, sub_id, filename, fields):
+        """Record a submission whose document is already at upload_path(sub_id) and queue it"""
+        with open(self.upload_path(sub_id), 'rb') as f:
+            os.fsync(f.fileno())
+
+        now = datetime.now().isoformat()
+        submission = {
+            'id': sub_id,
+            'status': 'queued',
+            'filename': filename,
+            'fields': fields,
+            'created_at': now,
+            'updated_at': now
+        }
+        self._save(submission)
+        self._executor.submit(self._run, sub_id)
+        return submission
+
+    def get(self, sub_id, wait=0):
+        """Return a submission, waiting up to wait seconds for it to finish"""
+        if not SUBMISSION_ID_RE.match(sub_id):
+            return None
+
+        deadline = time.monotonic() + wait
+        with self._cond:
+            while True:
+                submission = self._load(sub_id)
+                remaining = deadline - time.monotonic()
+                if submission is None or submission['status'] not in PENDING or remaining <= 0:
+                    return submission
+                self._cond.wait(remaining)
+
+    def recover(self):
+        """Queue submissions left unfinished by a previous run and prune old ones
+
+        Only the first call does anything, so a submission is never queued
+        twice. Returns how many were queued.
+        """
+        with self._cond:
+            if self._recovered:
+                return 0
+            self._recovered = True
+
+        queued = []
+        for name in sorted(os.listdir(self.root)):
+            if not name.endswith('.json'):
+                continue
+            submission = self._load(name[:-len('.json')])
+            if submission is not None and submission['status'] in PENDING:
+                queued.append(submission)
+
+        for submission in sorted(queued, key=lambda s: s['created_at']):
+            self._executor.submit(self._run, submission['id'])
+        self._prune()
+        return len(queued)
+
+    def _run(self, sub_id):
+        submission = self._load(sub_id)
+        if submission is None or submission['status'] not in PENDING:
+            return
+
+        self._update(submission, status='forwarding')
+        try:
+            result = self.forward(dict(submission, upload_path=self.upload_path(sub_id)))
+        except Exception as e:
+            result = {'status': 'failed', 'error': f'Relay error: {str(e)}'}
+        self._update(submission, **result)
+
+        try:
+            os.remove(self.upload_path(sub_id))
+        except OSError:
+            pass
+        if time.monotonic() - self._last_prune > 60 * 60:
+            self._prune()
+
+    def _update(self, submission, **fields):
+        submission.update(fields, updated_at=datetime.now().isoformat())
+        self._save(submission)
+        with self._cond:
+            self._cond.notify_all()
+
+    def _save(self, submission):
+        path = self._state_path(submission['id'])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(submission, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _load(self, sub_id):
+        try:
+            with open(self._state_path(sub_id), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _prune(self):
+        self._last_prune = time.monotonic()
+        cutoff = time.time() - KEEP_FINISHED_SECONDS
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            sub_id, ext = os.path.splitext(name)
+            if ext == '.json':
+                submission = self._load(sub_id)
+                if submission is None or submission['status'] in PENDING:
+                    continue
+            elif ext != '.upload' or os.path.exists(self._state_path(sub_id)):
+                continue
+            # An .upload with no state file is left from a request that died mid-upload
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,164 @@
+import zlib
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 64 * 1024
+MAX_FIELD_SIZE = 64 * 1024
+# Content-Encodings we can compress uploads with, preferred first
+UPLOAD_ENCODINGS = (('zstd',) if zstandard is not None else ()) + ('gzip',)
+# A document is sent compressed only if a sample of it shrinks below this
+# fraction of its size (zip-based Office files, JPEG and PNG don't)
+COMPRESS_RATIO = 0.9
+MIN_COMPRESS_SAMPLE = 1024
+
+
+class FormRelay:
+    """Reads an incoming multipart/form-data body one part at a time
+
+    read_fields() collects form fields until the next file part, so a caller
+    can decide where the file goes before any of it has arrived, then
+    file_chunks() yields that file's data as it comes off the socket. Nothing
+    is written to disk and at most one read chunk (plus one field) is held in
+    memory. Raises ValueError if the body isn't valid multipart.
+    """
+
+    def __init__(self, stream, content_type):
+        mimetype, options = parse_options_header(content_type or '')
+        boundary = options.get('boundary')
+        if mimetype != 'multipart/form-data' or not boundary:
+            raise ValueError("Expected a multipart/form-data body")
+
+        self.fields = {}
+        self.file = None
+        self._stream = stream
+        # The decoder's buffer limit has to leave room for a whole read chunk
+        self._decoder = MultipartDecoder(boundary.encode(),
+                                         max_form_memory_size=MAX_FIELD_SIZE + CHUNK_SIZE)
+        self._events = self._read_events()
+
+    def _read_events(self):
+        while True:
+            chunk = self._stream.read(CHUNK_SIZE)
+            self._decoder.receive_data(chunk or None)
+            event = self._decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                yield event
+                event = self._decoder.next_event()
+
+            if isinstance(event, Epilogue):
+                return
+            if not chunk:
+                raise ValueError("Form data ended unexpectedly")
+
+    def read_fields(self):
+        """Read fields up to the next file part and return it (also self.file), or None"""
+        self.file = None
+        name = None
+        value = []
+        for event in self._events:
+            if isinstance(event, Field):
+                name = event.name
+                value = []
+            elif isinstance(event, File):
+                self.file = event
+                return event
+            elif isinstance(event, Data):
+                value.append(event.data)
+                if sum(len(piece) for piece in value) > MAX_FIELD_SIZE:
+                    raise ValueError(f"Form field {name} is too large")
+                if not event.more_data:
+                    self.fields.setdefault(name, b''.join(value).decode('utf-8', 'replace'))
+        return None
+
+    def file_chunks(self):
+        """Yield the data of the file part returned by read_fields()"""
+        for event in self._events:
+            if isinstance(event, Data):
+                if event.data:
+                    yield event.data
+                if not event.more_data:
+                    return
+
+    def skip_files(self):
+        """Read the rest of the body, keeping fields and dropping any further files"""
+        while self.read_fields() is not None:
+            for _ in self.file_chunks():
+                pass
+
+
+def encode_fields(boundary, fields):
+    """Encode form fields as multipart/form-data parts"""
+    return b''.join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode()
+        + str(value).encode('utf-8') + b'\r\n'
+        for name, value in fields.items())
+
+
+def encode_file_header(boundary, name, filename, content_type=None):
+    """Encode the headers of a file part; its data and a CRLF follow"""
+    return (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+            f'filename="{filename}"\r\nContent-Type: {content_type or "application/octet-stream"}'
+            f'\r\n\r\n').encode('utf-8')
+
+
+def encode_end(boundary):
+    return f'--{boundary}--\r\n'.encode()
+
+
+def multipart_body(boundary, fields, filename, content_type, chunks, late_fields=None):
+    """Generate a multipart/form-data body with one file part
+
+    late_fields, if given, is called once the file has been sent and returns
+    more fields to add after it.
+    """
+    yield encode_fields(boundary, fields)
+    yield encode_file_header(boundary, 'file', filename, content_type)
+    yield from chunks
+    yield b'\r\n'
+    if late_fields is not None:
+        yield encode_fields(boundary, late_fields())
+    yield encode_end(boundary)
+
+
+def multipart_files_body(boundary, fields, files):
+    """Generate a multipart/form-data body with a file part per (filename, content_type, chunks)"""
+    yield encode_fields(boundary, fields)
+    for filename, content_type, chunks in files:
+        yield encode_file_header(boundary, 'file', filename, content_type)
+        yield from chunks
+        yield b'\r\n'
+    yield encode_end(boundary)
+
+
+def choose_encoding(sample, accepted):
+    """Pick a Content-Encoding the server accepts, or None if sample doesn't compress"""
+    encodings = [encoding for encoding in UPLOAD_ENCODINGS if encoding in accepted]
+    if not encodings or len(sample) < MIN_COMPRESS_SAMPLE:
+        return None
+    # A fast, low-level pass is enough to tell already-compressed data apart
+    if len(zlib.compress(sample, 1)) > len(sample) * COMPRESS_RATIO:
+        return None
+    return encodings[0]
+
+
+def encode_chunks(chunks, encoding):
+    """Compress a stream of chunks with a Content-Encoding (None passes them through)"""
+    if encoding is None:
+        yield from chunks
+        return
+
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    else:
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()